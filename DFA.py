@@ -5,21 +5,141 @@
 # Contact: andrewbadr@gmail.com
 # Code contributions are welcome.
 
+import sys
+import time
+import mmap
+import struct
+import ctypes
 from copy import copy
+from array import array
+from collections import OrderedDict, deque
+from functools import wraps
 from UnionFind import UnionFind
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#
+# Instrumentation: opt-in profiling of the DFA operations
+#
+
+_profilers = []
+
+class Profiler:
+    """Records what the DFA operations do while it is active, to show where the time
+    goes in a pipeline such as finite_factor():
+
+        with Profiler() as p:
+            D.hyper_minimize()
+        p.pretty_print()
+
+    The collected data is kept in these attributes:
+     - phases: maps each phase name to [number of calls, total seconds]. Nested phases
+       are timed inclusively, so "hyper_minimize" also covers its "minimize" step.
+     - delta_calls: the number of calls made to user-supplied delta functions by whole-
+       automaton operations. Calls made by input() and friends are not counted.
+     - rounds: a list of (algorithm, number of blocks) pairs, one for every refinement
+       round of a partitioning algorithm.
+     - product_states: a list of (operation, number of states) pairs, one for every
+       product automaton built or searched.
+    Profilers can be nested, and every active one records. When none is active, each
+    hook costs a single test of a module-level list.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.delta_calls = 0
+        self.rounds = []
+        self.product_states = []
+
+    def __enter__(self):
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _profilers.remove(self)
+        return False
+
+    def pretty_print(self):
+        """Displays the collected data in an easy-to-read way."""
+        print ""
+        print "Phases:"
+        for (name, (calls, seconds)) in sorted(self.phases.items(), key=lambda x: -x[1][1]):
+            print "\t%-28s %6d calls %10.4fs" % (name, calls, seconds)
+        print "Delta calls:", self.delta_calls
+        print "Refinement rounds:", len(self.rounds)
+        if len(self.rounds):
+            print "\tlast:", self.rounds[-1]
+        print "Product states:", self.product_states
+        print ""
+
+class _Phase:
+    """A context manager timing a named phase for every active Profiler."""
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _profilers:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            seconds = time.time() - self.start
+            for p in _profilers:
+                entry = p.phases.setdefault(self.name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+        return False
+
+def _timed(name):
+    """Decorates a function so that every call is timed as the phase "name"."""
+    def decorate(function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            if not _profilers:
+                return function(*args, **kwargs)
+            with _Phase(name):
+                return function(*args, **kwargs)
+        return timed
+    return decorate
+
+def _count_delta(calls):
+    for p in _profilers:
+        p.delta_calls += calls
+
+def _record_round(algorithm, blocks):
+    for p in _profilers:
+        p.rounds.append((algorithm, blocks))
+
+def _record_product(operation, states):
+    for p in _profilers:
+        p.product_states.append((operation, states))
+
+#The labels of an unlabeled state
+_NO_LABELS = frozenset()
 
 # TODO: general code cleanup
 # TODO: write tests
 
 class DFA:
     """This class represents a deterministic finite automaton."""
-    def __init__(self, states, alphabet, delta, start, accepts):
+    def __init__(self, states, alphabet, delta, start, accepts, labels=None):
         """The inputs to the class are as follows:
          - states: An iterable containing the states of the DFA. States must be immutable.
          - alphabet: An iterable containing the symbols in the DFA's alphabet. Symbols must be immutable.
          - delta: A complete function from [states]x[alphabets]->[states].
          - start: The state at which the DFA begins operation.
          - accepts: A list containing the "accepting" or "final" states of the DFA.
+         - labels: Optionally, a dict mapping accepting states to iterables of labels,
+           such as the ids of the patterns they match. Set operations combine the
+           labels of their operands, and minimization only merges states with equal
+           labels. See label_accepts() and matches().
 
         Making delta a function rather than a transition table makes it much easier to define certain DFAs. 
         If you want to use a transition table, you can just do this:
@@ -36,6 +156,11 @@ class DFA:
         self.accepts = set(accepts)
         self.alphabet = set(alphabet)
         self.current_state = start
+        self.labels = None
+        if labels is not None:
+            self.labels = dict([(q, frozenset(l)) for (q, l) in labels.iteritems()])
+        self.symbol_map = None
+        self._incremental = None
 
 #
 # Administrative functions:
@@ -76,7 +201,101 @@ class DFA:
 
     def copy(self):
         """Returns a copy of the DFA. No data is shared with the original."""
-        return DFA(self.states, self.alphabet, self.delta, self.start, self.accepts)
+        if self._incremental is not None and self._incremental.describes(self):
+            return self.compile().to_dfa()
+        D = DFA(self.states, self.alphabet, self.delta, self.start, self.accepts, self.labels)
+        D.symbol_map = self.symbol_map
+        return D
+
+    def label_accepts(self, label):
+        """Adds "label" to the labels of every accepting state, so that after a union
+        with other DFAs one can tell which operands accepted.
+        """
+        if self.labels is None:
+            self.labels = {}
+        for q in self.accepts:
+            self.labels[q] = self.labels.get(q, _NO_LABELS) | frozenset([label])
+
+    def labels_of(self, q):
+        """Returns the frozenset of labels of state q."""
+        if self.labels is None:
+            return _NO_LABELS
+        return self.labels.get(q, _NO_LABELS)
+
+    def save(self, path):
+        """Writes the DFA to a file in a compact binary format; see CompactDFA.save()."""
+        self.compile().save(path)
+
+    @staticmethod
+    def load(path, use_mmap=True):
+        """Reads a DFA written by save(). Its delta looks transitions up in the stored
+        table, which is memory-mapped unless "use_mmap" is false; see CompactDFA.load().
+        """
+        return CompactDFA.load(path, use_mmap).to_dfa()
+
+    def cache_delta(self, policy="full", maxsize=None):
+        """Wraps the DFA's transition function in a DeltaCache, so that each (state, symbol)
+        pair is computed only once; useful when delta is expensive. See DeltaCache for
+        the "policy" and "maxsize" options. Returns the cache, which is also self.delta
+        and keeps hit/miss statistics. state_merge(), merge_states() and collapse()
+        replace it with a fresh cache of the same kind.
+        """
+        delta = self.delta
+        if isinstance(delta, DeltaCache):
+            delta = delta.delta
+        self.delta = DeltaCache(delta, policy, maxsize)
+        return self.delta
+
+    @_timed("compile")
+    def compile(self):
+        """Returns a CompactDFA snapshot of the DFA, with delta evaluated once for
+        every (state, symbol) pair and stored in a flat integer table. Later changes
+        to the DFA are not reflected in the snapshot.
+        """
+        states = list(self.states)
+        alphabet = list(self.alphabet)
+        state_ids = {}
+        for (i, q) in enumerate(states):
+            state_ids[q] = i
+        table = array('i')
+        for q in states:
+            for c in alphabet:
+                table.append(state_ids[self.delta(q, c)])
+        _count_delta(len(table))
+        accepting = bytearray(len(states))
+        for q in self.accepts:
+            if q in state_ids:
+                accepting[state_ids[q]] = 1
+        C = CompactDFA(states, alphabet, table, state_ids[self.start], accepting)
+        if self.labels is not None:
+            C.labels = [self.labels.get(q, _NO_LABELS) for q in states]
+        if self.symbol_map is not None:
+            for (c, representative) in self.symbol_map.iteritems():
+                C.symbol_ids[c] = C.symbol_ids[representative]
+        return C
+
+    def compress_alphabet(self):
+        """Replaces the alphabet with one representative symbol for each class of
+        symbols that have the same transitions from every state (see
+        CompactDFA.symbol_classes()), so that every algorithm looping over the
+        alphabet runs over the classes instead. Input is still given in the
+        original symbols: "symbol_map" maps each of them to its representative,
+        and input(), recognizes(), compile() and the operations built on them
+        translate through it. Set operations need both DFAs over the same
+        alphabet, so compress their result rather than their arguments (products
+        of DFAs compressed alike keep the symbol map; others raise ValueError),
+        and add_word() and the other edits are not available afterwards.
+        Returns the number of symbol classes.
+        """
+        C = self.compile().compress_alphabet()
+        symbol_map = {}
+        for (c, j) in C.symbol_ids.iteritems():
+            symbol_map[c] = C.alphabet[j]
+        self.alphabet = set(C.alphabet)
+        self.delta = C.to_dfa().delta
+        self.symbol_map = symbol_map
+        self._incremental = None
+        return len(C.alphabet)
 
 #
 # Simulating execution:
@@ -84,6 +303,8 @@ class DFA:
 
     def input(self, char):
         """Updates the DFA's current state based on a single character of input."""
+        if self.symbol_map is not None:
+            char = self.symbol_map[char]
         self.current_state = self.delta(self.current_state, char)
 
     def input_sequence(self, char_sequence):
@@ -108,6 +329,31 @@ class DFA:
         self.current_state = state_save
         return valid
 
+    def recognize_many(self, sequences):
+        """Returns a list indicating, for each string in the iterable "sequences",
+        whether the DFA accepts it. The DFA is compiled once for the whole batch,
+        and its current state is left untouched.
+        """
+        return self.compile().recognize_many(sequences)
+
+    def scan(self, source, restart=False, chunk_size=65536):
+        """Compiles the DFA and scans a string, buffer, mmap or file-like object
+        with it; see CompactDFA.scan().
+        """
+        return self.compile().scan(source, restart, chunk_size)
+
+    def matches(self, source, chunk_size=65536):
+        """Compiles the DFA and reports the labels it accepts with along a string,
+        buffer, mmap or file-like object; see CompactDFA.matches().
+        """
+        return self.compile().matches(source, chunk_size)
+
+    def cursor(self):
+        """Compiles the DFA and returns a Cursor on the snapshot. To share one table
+        among many streams, compile once and call cursor() on the CompactDFA.
+        """
+        return self.compile().cursor()
+
 #
 # Minimization methods and their helper functions
 #
@@ -127,59 +373,140 @@ class DFA:
         """Merges q1 into q2. All transitions to q1 are moved to q2.
         If q1 was the start or current state, those are also moved to q2.
         """
-        self.states.remove(q1)
-        if q1 in self.accepts:
-            self.accepts.remove(q1)
-        if self.current_state == q1:
-            self.current_state = q2
-        if self.start == q1:
-            self.start = q2
+        self.merge_states({q1: q2})
+
+    @_timed("merge_states")
+    def merge_states(self, mapping):
+        """Merges every state q in the dict "mapping" into mapping[q], as if by
+        state_merge(q, mapping[q]), but rebuilds the transition function only once.
+        Chains of merges (q1->q2, q2->q3) are followed to their end; a cycle of
+        merges (q1->q2, q2->q1) raises ValueError, before the DFA is changed.
+        """
+        mapping = dict([(q1, q2) for (q1, q2) in mapping.iteritems() if q1 != q2])
+        #Resolve every chain once, compressing the paths as we go
+        final = {}
+        for q in mapping:
+            path = []
+            on_path = set()
+            while q in mapping and q not in final:
+                if q in on_path:
+                    raise ValueError("Cyclic state merge through %r" % (q,))
+                path.append(q)
+                on_path.add(q)
+                q = mapping[q]
+            end = final.get(q, q)
+            for p in path:
+                final[p] = end
+        def target(q):
+            return final.get(q, q)
+        self.states = [q for q in self.states if q not in mapping]
+        self.accepts = [q for q in self.accepts if q not in mapping]
+        if self.labels is not None:
+            self.labels = dict([(q, l) for (q, l) in self.labels.iteritems() if q not in mapping])
+        self.current_state = target(self.current_state)
+        self.start = target(self.start)
         transitions = {}
-        for state in self.states: #without q1
+        for state in self.states:
             transitions[state] = {}
             for char in self.alphabet:
-                next = self.delta(state, char)
-                if next == q1:
-                    next = q2
-                transitions[state][char] = next
-        self.delta = (lambda s, c: transitions[s][c])
+                transitions[state][char] = target(self.delta(state, char))
+        _count_delta(len(self.states)*len(self.alphabet))
+        new_delta = (lambda s, c: transitions[s][c])
+        if isinstance(self.delta, DeltaCache):
+            new_delta = self.delta.renew(new_delta)
+        self.delta = new_delta
+
+    def bfs(self, sources=None, stop=None):
+        """Breadth-first search from the states in the list "sources" (by default,
+        the start state), calling delta only on the states reached. Returns a pair
+        (distances, found), where distances is a dictionary mapping every state
+        reached to the length of the shortest path to it from a source. If "stop"
+        is given, the search ends at the first state q reached for which stop(q) is
+        true, which is returned as "found" (None otherwise).
+        """
+        if sources is None:
+            sources = [self.start]
+        distances = {}
+        queue = deque()
+        for q in sources:
+            if q not in distances:
+                distances[q] = 0
+                if stop is not None and stop(q):
+                    return (distances, q)
+                queue.append(q)
+        while queue:
+            q = queue.popleft()
+            distance = distances[q] + 1
+            _count_delta(len(self.alphabet))
+            for c in self.alphabet:
+                next = self.delta(q, c)
+                if next not in distances:
+                    distances[next] = distance
+                    if stop is not None and stop(next):
+                        return (distances, next)
+                    queue.append(next)
+        return (distances, None)
+
+    def dfs(self, sources=None, stop=None):
+        """Depth-first search from the states in the list "sources" (by default, the
+        start state). Returns a pair (reached, found), where reached is the set of
+        states reached, and "stop" and "found" are as in bfs().
+        """
+        if sources is None:
+            sources = [self.start]
+        reached = set()
+        stack = []
+        for q in sources:
+            if q not in reached:
+                reached.add(q)
+                if stop is not None and stop(q):
+                    return (reached, q)
+                stack.append(q)
+        while stack:
+            q = stack.pop()
+            _count_delta(len(self.alphabet))
+            for c in self.alphabet:
+                next = self.delta(q, c)
+                if next not in reached:
+                    reached.add(next)
+                    if stop is not None and stop(next):
+                        return (reached, next)
+                    stack.append(next)
+        return (reached, None)
 
     def reachable_from(self, q0, inclusive=True):
-        """Returns the set of states reachable from given state q0. The optional
+        """Returns the list of states reachable from given state q0. The optional
         parameter "inclusive" indicates that q0 should always be included.
         """
-        reached = self.state_hash(False)
         if inclusive:
-            reached[q0] = True
-        to_process = [q0]
-        while len(to_process):
-            q = to_process.pop()
-            for c in self.alphabet:
-                next = self.delta(q, c)
-                if reached[next] == False:
-                    reached[next] = True
-                    to_process.append(next)
-        return filter(lambda q: reached[q], self.states)
+            sources = [q0]
+        else:
+            sources = [self.delta(q0, c) for c in self.alphabet]
+        return list(self.dfs(sources)[0])
 
     def reachable(self):
         """Returns the reachable subset of the DFA's states."""
         return self.reachable_from(self.start)
 
+    @_timed("delete_unreachable")
     def delete_unreachable(self):
         """Deletes all the unreachable states."""
-        reachable = self.reachable()
-        self.states = reachable
-        new_accepts = []
-        for q in self.accepts:
-            if q in self.states:
-                new_accepts.append(q)
-        self.accepts = new_accepts
+        reachable = self.dfs()[0]
+        self.states = [q for q in self.states if q in reachable]
+        self.accepts = [q for q in self.accepts if q in reachable]
 
+    @_timed("mn_classes")
     def mn_classes(self):
         """Returns a partition of self.states into Myhill-Nerode equivalence classes."""
         changed = True
         classes = []
-        if self.accepts != []:
+        if self.labels:
+            #Accepting states start out split by their labels
+            groups = {}
+            for q in self.accepts:
+                groups.setdefault(self.labels_of(q), []).append(q)
+            classes.extend(groups.values())
+        elif self.accepts != []:
             classes.append(self.accepts)
         nonaccepts = filter(lambda x: x not in self.accepts, self.states)
         if nonaccepts != []:
@@ -191,6 +518,7 @@ class DFA:
                 for alpha in self.alphabet:
                     next_class = None
                     new_class = []
+                    _count_delta(len(cl))
                     for state in cl:
                         next = self.delta(state, alpha)
                         if next_class == None:
@@ -209,9 +537,18 @@ class DFA:
                         classes.remove(cl)
                         classes.append(old_class)
                         classes.append(new_class)
+                        _record_round("mn_classes", len(classes))
                         break
         return classes
 
+    def hopcroft_classes(self):
+        """Returns a partition of self.states into Myhill-Nerode equivalence classes,
+        using Hopcroft's O(n*logn) partition-refinement algorithm.
+        """
+        C = self.compile()
+        return [[C.states[i] for i in block] for block in C.hopcroft_classes()]
+
+    @_timed("collapse")
     def collapse(self, partition):
         """Given a partition of the DFA's states into equivalence classes,
         collapses every equivalence class into a single "representative" state.
@@ -235,16 +572,22 @@ class DFA:
                 if state == self.current_state:
                     new_current_state = representative
         #build new_accepts:
+        representatives = set(new_states)
         for acc in self.accepts:
-            if acc in new_states:
+            if acc in representatives:
                 new_accepts.append(acc)
+        if self.labels is not None:
+            self.labels = dict([(q, self.labels[q]) for q in new_states if q in self.labels])
         #build new_delta:
         transitions = {}
         for state in new_states:
             transitions[state] = {}
             for alpha in self.alphabet:
                 transitions[state][alpha] = state_map[self.delta(state, alpha)]
+        _count_delta(len(new_states)*len(self.alphabet))
         new_delta = (lambda s, a: transitions[s][a])
+        if isinstance(self.delta, DeltaCache):
+            new_delta = self.delta.renew(new_delta)
         self.states = new_states
         self.start = new_start
         self.delta = new_delta
@@ -252,10 +595,27 @@ class DFA:
         self.current_state = new_current_state
         return state_map
 
-    def minimize(self):
-        """Classical DFA minimization, using the simple O(n^2) algorithm.
+    @_timed("minimize")
+    def minimize(self, algorithm="hopcroft"):
+        """Classical DFA minimization. The optional "algorithm" parameter selects
+        how the Myhill-Nerode classes are found:
+         - "hopcroft": Hopcroft's O(n*logn) partition refinement (the default).
+         - "simple": the simple O(n^2) algorithm, see mn_classes().
         Side effect: can mix up the internal ordering of states.
         """
+        if algorithm not in ("hopcroft", "simple"):
+            raise ValueError("Unknown minimization algorithm: %r" % (algorithm,))
+        if algorithm == "hopcroft":
+            #Steps 1 and 2 run on a single compiled snapshot of the DFA
+            C = self.compile()
+            with _Phase("delete_unreachable"):
+                reached = C.reachable_from(C.start)
+                self.states = [C.states[i] for i in reached]
+                self.accepts = [C.states[i] for i in reached if C.accepting[i]]
+            classes = [[C.states[i] for i in block] for block in C.hopcroft_classes(reached)]
+            #Step 3: Construct the new DFA
+            self.collapse(classes)
+            return
         #Step 1: Delete unreachable states
         self.delete_unreachable()
         #Step 2: Partition the states into equivalence classes        
@@ -263,6 +623,15 @@ class DFA:
         #Step 3: Construct the new DFA
         self.collapse(classes)
 
+    def sccs(self):
+        """Returns the strongly connected components of the transition graph, as
+        lists of states. Every component is listed after all the components
+        reachable from it, so the reversed list is in topological order.
+        """
+        C = self.compile()
+        return [[C.states[i] for i in component] for component in C.sccs()]
+
+    @_timed("preamble_and_kernel")
     def preamble_and_kernel(self):
         """Returns the partition of the state-set into the preamble and 
         kernel as a 2-tuple. A state is in the preamble iff there 
@@ -270,56 +639,33 @@ class DFA:
 
         See "The DFAs of Finitely Different Regular Languages" for context.
         """
-        #O(n^2): can this be improved?
-        reachable = {}
-        for q in self.states:
-            reachable[q] = self.reachable_from(q, inclusive=False)
-        in_fin = self.state_hash(True)
-        for q in reachable[self.start]:
-            if q in reachable[q]:
-                for next in reachable[q]:
-                    in_fin[next] = False
-        preamble = filter(lambda x: in_fin[x], self.states)
-        kernel = filter(lambda x: not in_fin[x], self.states)
+        #A state is in the kernel iff it can be reached from a cycle that is
+        # itself reachable from the start state. Runs in linear time.
+        C = self.compile()
+        k, table = len(C.alphabet), C.table
+        reached = bytearray(len(C.states))
+        for i in C.reachable_from(C.start):
+            reached[i] = 1
+        in_kernel = bytearray(len(C.states))
+        for component in reversed(C.sccs()):
+            i = component[0]
+            if in_kernel[i] or (reached[i] and C.is_cyclic(component)):
+                for i in component:
+                    in_kernel[i] = 1
+                    for next in table[i*k:i*k+k]:
+                        in_kernel[next] = 1
+        preamble = filter(lambda x: not in_kernel[C.state_ids[x]], self.states)
+        kernel = filter(lambda x: in_kernel[C.state_ids[x]], self.states)
         return (preamble, kernel)
 
     def pluck_leaves(self):
         """Only for minimized automata. Returns a topologically ordered list of
         all the states that induce a finite language. Runs in linear time.
         """
-        #Step 1: Build the states' profiles
-        loops    = self.state_hash(0)
-        inbound  = self.state_hash(list)
-        outbound = self.state_hash(list)
-        for state in self.states:
-            for c in self.alphabet:
-                next = self.delta(state, c)
-                inbound[next].append(state)
-                outbound[state].append(next)
-                if state == next:
-                    loops[state] += 1
-        #Step 2: Add sink state to to_pluck
-        to_pluck = []
-        for state in self.states:
-            if len(outbound[state]) == loops[state]:
-                if not state in self.accepts:
-                    #prints("Adding '%s' to be plucked" % state)
-                    to_pluck.append(state)
-        #Step 3: Pluck!
-        plucked = []
-        while len(to_pluck):
-            state = to_pluck.pop()
-            #prints("Plucking %s" % state)
-            plucked.append(state)
-            for incoming in inbound[state]:
-                #prints("Deleting %s->%s edge" % (incoming, state))
-                outbound[incoming].remove(state)
-                if (len(outbound[incoming]) == 0) and (incoming != state):
-                    to_pluck.append(incoming)
-                    #prints("Adding '%s' to be plucked" % incoming)
-        plucked.reverse()
-        return plucked
+        C = self.compile()
+        return [C.states[i] for i in C.pluck_leaves()]
 
+    @_timed("right_finite_states")
     def right_finite_states(self, sink_states):
         """Given a DFA (self) and a list of states (sink_states) that are assumed to induce the
         empty language, return the topologically-ordered set of states in the DFA that induce
@@ -335,6 +681,7 @@ class DFA:
                 next = self.delta(state, c)
                 inbound[next].append(state)
                 outbound[state].append(next)
+            _count_delta(len(self.alphabet))
 
         #Step 2: Pluck!
         to_pluck = sink_states
@@ -351,18 +698,16 @@ class DFA:
  
     def is_finite(self):
         """Indicates whether the DFA's language is a finite set."""
-        D2 = self.copy()
-        D2.minimize()
-        plucked = D2.pluck_leaves()
-        return (D2.start in plucked)
+        return self.compile().is_finite()
 
     def states_fd_equivalent(self, q1, q2):
         """Indicates whether q1 and q2 only have finitely many distinguishing strings."""
         d1 = DFA(states=self.states, start=q1, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
         d2 = DFA(states=self.states, start=q2, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
-        sd_dfa = symmetric_difference(d1, d2)
+        sd_dfa = symmetric_difference(d1, d2, lazy=True)
         return sd_dfa.is_finite()
 
+    @_timed("f_equivalence_classes")
     def f_equivalence_classes(self):
         """Returns a partition of the states into finite-difference equivalence clases, using
         the experimental O(n^2) algorithm."""
@@ -379,75 +724,84 @@ class DFA:
         state_classes = sets.as_lists()
         return state_classes
 
-    def hyper_minimize(self):
+    @_timed("hyper_minimize")
+    def hyper_minimize(self, algorithm="f_equivalence"):
         """Alters the DFA into a smallest possible DFA recognizing a finitely different language.
         In other words, if D is the original DFA and D' the result of this function, then the 
         symmetric difference of L(D) and L(D') will be a finite set, and there exists no smaller
         automaton than D' with this property.
 
-        See "The DFAs of Finitely Different Regular Languages" for context.
+        See "The DFAs of Finitely Different Regular Languages" for context. The optional
+        "algorithm" parameter selects how the finite-difference classes are found:
+         - "f_equivalence": the experimental O(n^2) algorithm, see f_equivalence_classes().
+         - "holzer_maletti": the O(n*logn) algorithm of Holzer and Maletti, see
+           CompactDFA.almost_equivalence_classes().
         """
+        if algorithm not in ("f_equivalence", "holzer_maletti"):
+            raise ValueError("Unknown hyper-minimization algorithm: %r" % (algorithm,))
         # Step 1: Classical minimization
         self.minimize()
         # Step 2: Partition states into equivalence classes
-        state_classes = self.f_equivalence_classes()
+        if algorithm == "holzer_maletti":
+            C = self.compile()
+            state_classes = [[C.states[i] for i in sc] for sc in C.almost_equivalence_classes()]
+        else:
+            state_classes = self.f_equivalence_classes()
         # Step 3: Find preamble and kernel parts
         (preamble, kernel) = self.preamble_and_kernel()
+        preamble, kernel = set(preamble), set(kernel)
         # Step 4: Merge (f_merge_states in the paper)
-        # (Could be done more efficiently)
+        mapping = {}
         for sc in state_classes:
             pres = filter(lambda s: s in preamble, sc)
             kers = filter(lambda s: s in kernel, sc)
             if len(kers):
                 rep = kers[0]
                 for p_state in pres:
-                    self.state_merge(p_state, rep)
+                    mapping[p_state] = rep
             else:
                 rep = pres[0]
                 for p_state in pres[1:]:
-                        self.state_merge(p_state, rep)
+                    mapping[p_state] = rep
+        self.merge_states(mapping)
 
     def levels(self):
         """Returns a dictionary mapping each state to its distance from the starting state."""
-        levels = {}
-        seen = [self.start]
-        levels[self.start] = 0
-        level_number = 0
-        level_states = [self.start]
-        while len(level_states):
-            next_level_states = []
-            next_level_number = level_number + 1
-            for q in level_states:
-                for c in self.alphabet:
-                    next = self.delta(q, c)
-                    if next not in seen:
-                        seen.append(next)
-                        levels[next] = next_level_number
-                        next_level_states.append(next)
-            level_states = next_level_states
-            level_number = next_level_number
-        return levels
+        return self.bfs()[0]
 
+    @_timed("longest_word_length")
     def longest_word_length(self):
         """Given a DFA recognizing a finite language, returns the length of the
         longest word in that language, or None if the language is empty.
-        Assumes the input is minimized.
+        Assumes the input is minimized. Runs in linear time.
         """
-        assert(self.is_finite())
-        def long_path(q,length, longest):
-            if q in self.accepts:
-                if length > longest:
-                    longest = length
-            for char in self.alphabet:
-                next = self.delta(q, char)
-                if next != q:
-                    candidate = long_path(next, length+1, longest)
-                    if candidate > longest:
-                        longest = candidate
-            return longest
-        return long_path(self.start, 0, None)
-
-    def DFCA_minimize(self, l=None):
+        return self.compile().longest_word_length()
+
+    def shortest_word_length(self):
+        """Returns the length of the shortest word in the DFA's language, or None if
+        the language is empty. The language may be infinite.
+        """
+        accepts = set(self.accepts)
+        (distances, found) = self.bfs(stop=lambda q: q in accepts)
+        if found is None:
+            return None
+        return distances[found]
+
+    def length_counts(self):
+        """Given a minimized DFA recognizing a finite language, returns a list whose
+        m-th item is the number of words of length m in the language.
+        """
+        return self.compile().length_counts()
+
+    def words(self):
+        """Given a minimized DFA recognizing a finite language, returns an iterator
+        over the words of the language, as lists of symbols, in lexicographic order.
+        The words are generated lazily.
+        """
+        return self.compile().words()
+
+    @_timed("DFCA_minimize")
+    def DFCA_minimize(self, l=None, algorithm="gap"):
         """DFCA minimization"
         Input: "self" is a DFA accepting a finite language
         Result: "self" is DFCA-minimized, and the returned value is the length of the longest
@@ -455,27 +809,42 @@ class DFA:
 
         See "Minimal cover-automata for finite languages" for context on DFCAs, and
         "An O(n^2) Algorithm for Constructing Minimal Cover Automata for Finite Languages"
-        for the source of this algorithm (Campeanu, Paun, Santean, and Yu). We follow their
-        algorithm exactly, except that "l" is optionally calculated for you, and the state-
-        ordering is automatically created.
+        for the source of the default algorithm (Campeanu, Paun, Santean, and Yu). We follow
+        their algorithm, except that "l" is optionally calculated for you, the state-
+        ordering is automatically created, and states are merged in order of level.
         
-        There exists a faster, O(n*logn)-time algorithm due to Korner, from CIAA 2002.
+        Passing algorithm="korner" selects the O(n*logn) partition-refinement algorithm
+        of Korner, from CIAA 2002, for a fixed alphabet; see CompactDFA.cover_leaders().
         """
+        if algorithm not in ("gap", "korner"):
+            raise ValueError("Unknown DFCA minimization algorithm: %r" % (algorithm,))
 
         assert(self.is_finite())
 
         self.minimize()
 
-        ###Step 0: Numbering the states and computing "l"
-        n = len(self.states) - 1
-        state_order = self.pluck_leaves()
         if l==None:
             l = self.longest_word_length()
+        if algorithm == "korner":
+            C = self.compile()
+            leaders = C.cover_leaders(l)
+            mapping = {}
+            for (i, leader) in enumerate(leaders):
+                mapping[C.states[i]] = C.states[leader]
+            self.merge_states(mapping)
+            return l
+
+        ###Step 0: Numbering the states
+        n = len(self.states) - 1
+        state_order = self.pluck_leaves()
         #We're giving each state a numerical name so that the  algorithm can 
         # run on an "ordered" DFA -- see the paper for why. These functions
         # allow us to copiously convert between names.
+        numbers = {}
+        for (i, q) in enumerate(state_order):
+            numbers[q] = i
         def nn(q): # "numerical name"
-            return state_order.index(q)
+            return numbers[q]
         def rn(n): # "real name"
             return state_order[n]
 
@@ -500,6 +869,7 @@ class DFA:
         def level_range(i, j):
             return l - max(level[rn(i)], level[rn(j)])
         for i in range(n-2, -1, -1):
+            _count_delta(2*(n-i)*len(self.alphabet))
             for j in range(n, i, -1):
                 for char in self.alphabet:
                     i2 = nn(self.delta(rn(i), char))
@@ -518,56 +888,1444 @@ class DFA:
         for i in range(n+1):
             P[i] = False
         # 2.2
-        for i in range(n):
+        mapping = {}
+        by_level = sorted(range(n+1), key=lambda i: level[rn(i)])
+        for (x, i) in enumerate(by_level):
             if P[i] == False:
-                for j in range(i+1, n+1):
-                    if (P[j] == False) and (gap[(i,j)] == l):
-                        self.state_merge(rn(j), rn(i))
+                for j in by_level[x+1:]:
+                    if (P[j] == False) and (gap[(min(i,j),max(i,j))] == l):
+                        mapping[rn(j)] = rn(i)
                         P[j] = True
+        self.merge_states(mapping)
         return l
 
 #
-# Boolean set operations on languages -- end of the DFA class
+# Incremental editing of minimal DFAs
 #
 
-def cross_product(D1, D2, accept_method):
+    def _incremental_form(self):
+        """Returns the _Incremental bookkeeping for the DFA, building it (and
+        minimizing the DFA) unless the DFA is unchanged since the last edit.
+        """
+        inc = self._incremental
+        if inc is None or not inc.describes(self):
+            inc = self._incremental = _Incremental(self)
+        return inc
+
+    def _sync_incremental(self, inc):
+        self.start = inc.start
+        if self.current_state not in self.states:
+            self.current_state = self.start
+
+    def add_word(self, word):
+        """Adds a word to the DFA's language, keeping the DFA minimal.
+        The first edit minimizes the DFA and renames its states to integers; after
+        that, each add_word() or remove_word() clones only the states along the
+        word's path and merges the clones back into equivalent states, in time
+        proportional to the length of the word (Carrasco and Forcada's algorithm).
+        On automata with cycles longer than a self-loop, the states left unreachable
+        are found with a search of the whole automaton instead.
+        While the DFA is being edited, delta reads the live transition table;
+        copy() takes a snapshot.
+        """
+        inc = self._incremental_form()
+        inc.set_word(word, True)
+        self._sync_incremental(inc)
+
+    def remove_word(self, word):
+        """Removes a word from the DFA's language, keeping the DFA minimal; see add_word()."""
+        inc = self._incremental_form()
+        inc.set_word(word, False)
+        self._sync_incremental(inc)
+
+    def set_accepting(self, q, accepting=True):
+        """Makes state q accepting or not, keeping the DFA minimal. This changes
+        the language of every state that can reach q, so q and its predecessors
+        are re-merged with the states that became equivalent to them, working
+        backwards from q only. The first edit, and every edit of an automaton with
+        cycles longer than a self-loop, minimizes the DFA from scratch instead
+        (renaming its states to integers, as add_word() does).
+        """
+        inc = self._incremental
+        if inc is not None and inc.describes(self) and inc.acyclic:
+            inc.set_accepting(q, accepting)
+            self._sync_incremental(inc)
+            return
+        accepts = set(self.accepts)
+        if accepting:
+            accepts.add(q)
+        else:
+            accepts.discard(q)
+        self.accepts = accepts
+        self._incremental = _Incremental(self)
+
+#
+# Transition caching -- end of the DFA class
+#
+
+class DeltaCache:
+    """A memoizing wrapper around a transition function, as installed by DFA.cache_delta().
+    Instances are called like the function they wrap. The "policy" is one of:
+     - "full": remember every result. If "maxsize" is given, results past that many
+       are computed but no longer stored.
+     - "lru": remember the "maxsize" most recently used results (65536 by default).
+    The "hits" and "misses" attributes count the calls answered from the cache and
+    passed through to the wrapped function.
+    """
+    def __init__(self, delta, policy="full", maxsize=None):
+        if policy == "lru":
+            if maxsize is None:
+                maxsize = 65536
+            self.table = OrderedDict()
+        elif policy == "full":
+            self.table = {}
+        else:
+            raise ValueError("Unknown cache policy: %r" % (policy,))
+        self.delta = delta
+        self.policy = policy
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, q, c):
+        key = (q, c)
+        table = self.table
+        if key in table:
+            self.hits += 1
+            if self.policy == "lru":
+                next = table.pop(key)
+                table[key] = next
+                return next
+            return table[key]
+        self.misses += 1
+        next = self.delta(q, c)
+        if self.maxsize is None or len(table) < self.maxsize:
+            table[key] = next
+        elif self.policy == "lru":
+            table.popitem(last=False)
+            table[key] = next
+        return next
+
+    def __len__(self):
+        return len(self.table)
+
+    def clear(self):
+        """Forgets every cached result. The statistics are kept."""
+        self.table.clear()
+
+    def renew(self, delta):
+        """Returns an empty cache of the same kind wrapping another function."""
+        return DeltaCache(delta, self.policy, self.maxsize)
+
+#
+# Incremental maintenance of minimal DFAs
+#
+
+class _Incremental:
+    """The bookkeeping behind DFA.add_word(), remove_word() and set_accepting(), for
+    a DFA that is kept minimal. The states are integers; "trans" maps every state
+    to the list of its successors, one per symbol; "preds" maps every state to a
+    dict counting the transitions into it from every other state (self-loops are
+    left out); and "register" maps the signature of every state to the state.
+    In a minimal DFA two states are equivalent iff their signatures are equal, so
+    the register finds the state equivalent to a new or changed one in O(k).
+    """
+    def __init__(self, D):
+        #Edits of one symbol of a compressed alphabet would change its whole class,
+        # and the register does not tell labels apart
+        assert(D.symbol_map is None)
+        assert(D.labels is None)
+        D.minimize()
+        C = D.compile()
+        n, k = len(C.states), len(C.alphabet)
+        self.symbol_ids = C.symbol_ids
+        self.states = set(range(n))
+        self.accepts = set([i for i in range(n) if C.accepting[i]])
+        self.trans = {}
+        self.preds = {}
+        for i in range(n):
+            self.trans[i] = C.table[i*k:i*k+k].tolist()
+            self.preds[i] = {}
+        for i in range(n):
+            for next in self.trans[i]:
+                if next != i:
+                    self.preds[next][i] = self.preds[next].get(i, 0) + 1
+        self.register = {}
+        for i in range(n):
+            self.register[self.signature(i)] = i
+        self.start = C.start
+        self.next_state = n
+        #Without cycles (other than self-loops) a state with no predecessors is
+        #exactly a state that cannot be reached.
+        self.acyclic = not [component for component in C.sccs() if len(component) > 1]
+        trans, symbol_ids = self.trans, self.symbol_ids
+        self.delta = lambda q, c: trans[q][symbol_ids[c]]
+        D.current_state = C.state_ids.get(D.current_state, C.start)
+        D.states, D.accepts, D.start, D.delta = self.states, self.accepts, self.start, self.delta
+
+    def describes(self, D):
+        """Whether D is still the DFA this bookkeeping was built for and last updated."""
+        return (D.delta is self.delta and D.states is self.states
+                and D.accepts is self.accepts and D.start == self.start)
+
+    def signature(self, q):
+        """The acceptance of q and its successors, with self-loops marked by -1."""
+        return (q in self.accepts, tuple([(next == q and -1 or next) for next in self.trans[q]]))
+
+    def equivalent(self, q):
+        """Returns the registered state equivalent to q, or None. This assumes that
+        all the successors of q are registered. Besides the signature of q, tries
+        the signatures q would have if it were merged into each of its successors,
+        since the loops of that successor then match the transitions of q to it.
+        """
+        equivalent = self.register.get(self.signature(q))
+        if equivalent is not None and equivalent != q:
+            return equivalent
+        accepting = q in self.accepts
+        successors = self.trans[q]
+        for t in set(successors):
+            if t != q:
+                signature = (accepting, tuple([(next in (q, t) and -1 or next) for next in successors]))
+                if self.register.get(signature) == t:
+                    return t
+        return None
+
+    def unregister(self, q):
+        signature = self.signature(q)
+        if self.register.get(signature) == q:
+            del self.register[signature]
+
+    def add_state(self, successors, accepting):
+        q = self.next_state
+        self.next_state += 1
+        self.states.add(q)
+        if accepting:
+            self.accepts.add(q)
+        self.trans[q] = list(successors)
+        self.preds[q] = {}
+        for next in successors:
+            self.preds[next][q] = self.preds[next].get(q, 0) + 1
+        return q
+
+    def delete_state(self, q):
+        for next in self.trans[q]:
+            if next != q and next in self.preds:
+                self.drop_pred(next, q)
+        del self.trans[q]
+        del self.preds[q]
+        self.states.discard(q)
+        self.accepts.discard(q)
+
+    def drop_pred(self, q, p):
+        count = self.preds[q][p] - 1
+        if count:
+            self.preds[q][p] = count
+        else:
+            del self.preds[q][p]
+
+    def set_transition(self, p, j, q):
+        old = self.trans[p][j]
+        if old != p:
+            self.drop_pred(old, p)
+        self.trans[p][j] = q
+        if q != p:
+            self.preds[q][p] = self.preds[q].get(p, 0) + 1
+
+    @_timed("incremental.set_word")
+    def set_word(self, word, accepting):
+        """Adds or removes a word: clones the states along its path, so that the
+        word gets a path of its own, changes the acceptance of the last clone,
+        deletes the original states that became unreachable, and then merges the
+        clones, last to first, into the registered states equivalent to them.
+        """
+        symbols = [self.symbol_ids[c] for c in word]
+        path = [self.start]
+        for j in symbols:
+            path.append(self.trans[path[-1]][j])
+        if (path[-1] in self.accepts) == accepting:
+            return
+        clones = [self.add_state(self.trans[q], q in self.accepts) for q in path]
+        for (i, j) in enumerate(symbols):
+            self.set_transition(clones[i], j, clones[i+1])
+        if accepting:
+            self.accepts.add(clones[-1])
+        else:
+            self.accepts.discard(clones[-1])
+        self.start = clones[0]
+        self.delete_unreachable(path)
+        for i in range(len(clones)-1, -1, -1):
+            q = clones[i]
+            equivalent = self.equivalent(q)
+            if equivalent is None:
+                self.register[self.signature(q)] = q
+                continue
+            if i:
+                self.set_transition(clones[i-1], symbols[i-1], equivalent)
+            else:
+                self.start = equivalent
+            self.delete_state(q)
+
+    def delete_unreachable(self, candidates):
+        """Deletes the states that the last edit made unreachable, all of which are
+        among "candidates" (in path order) or, with cycles, reached only from them.
+        """
+        if self.acyclic:
+            for q in candidates:
+                if q in self.trans and q != self.start and not self.preds[q]:
+                    self.unregister(q)
+                    self.delete_state(q)
+            return
+        reached = set([self.start])
+        stack = [self.start]
+        while stack:
+            for next in self.trans[stack.pop()]:
+                if next not in reached:
+                    reached.add(next)
+                    stack.append(next)
+        _count_delta(len(reached)*len(self.symbol_ids))
+        unreachable = [q for q in self.trans if q not in reached]
+        for q in unreachable:
+            self.unregister(q)
+        for q in unreachable:
+            self.delete_state(q)
+
+    @_timed("incremental.set_accepting")
+    def set_accepting(self, q, accepting):
+        """Changes the acceptance of q, then merges every changed state that has an
+        equivalent into it, redirecting its predecessors, which changes them in turn.
+        The predecessors of a changed state that is kept are checked again as well,
+        since they may now match it with their transitions to it in place of its
+        loops. Only valid without cycles other than self-loops.
+        """
+        if (q in self.accepts) == accepting:
+            return
+        self.unregister(q)
+        if accepting:
+            self.accepts.add(q)
+        else:
+            self.accepts.discard(q)
+        #(state, whether its signature changed)
+        pending = [(q, True)]
+        while pending:
+            (q, changed) = pending.pop()
+            if q not in self.trans:
+                continue
+            equivalent = self.equivalent(q)
+            if equivalent is None:
+                self.register[self.signature(q)] = q
+                if changed:
+                    pending.extend([(p, False) for p in self.preds[q]])
+                continue
+            self.unregister(q)
+            for p in self.preds[q].keys():
+                self.unregister(p)
+                for (j, next) in enumerate(self.trans[p]):
+                    if next == q:
+                        self.set_transition(p, j, equivalent)
+                pending.append((p, True))
+            if self.start == q:
+                self.start = equivalent
+            self.delete_state(q)
+
+#
+# Compiled DFAs
+#
+
+_MAGIC = 'PYDFA\0\0\1'
+_HEADER = struct.Struct('<8sIIiQQQ')
+
+class CompactDFA:
+    """An array-backed snapshot of a DFA, as returned by DFA.compile(). States and
+    symbols are numbered densely from 0; the successor of state i on symbol j is
+    table[i*k+j], where k is the size of the alphabet, and accepting[i] is 1 iff
+    state i accepts. The original names are kept in the "states" and "alphabet"
+    lists, and the "state_ids" and "symbol_ids" dicts map them back to numbers.
+    If the DFA has labels, labels[i] is the frozenset of labels of state i;
+    otherwise "labels" is None.
+    """
+    def __init__(self, states, alphabet, table, start, accepting):
+        self.states = states
+        self.alphabet = alphabet
+        self.table = table
+        self.start = start
+        self.accepting = accepting
+        self.labels = None
+        self._match_reports = None
+        self.state_ids = {}
+        for (i, q) in enumerate(states):
+            self.state_ids[q] = i
+        self.symbol_ids = {}
+        for (j, c) in enumerate(alphabet):
+            self.symbol_ids[c] = j
+
+    def delta(self, i, j):
+        """Returns the number of the state reached from state i on symbol j."""
+        return self.table[i*len(self.alphabet)+j]
+
+    def recognizes(self, char_sequence):
+        """Indicates whether the automaton accepts a given string."""
+        table, k, symbol_ids = self.table, len(self.alphabet), self.symbol_ids
+        i = self.start
+        for c in char_sequence:
+            i = table[i*k+symbol_ids[c]]
+        return bool(self.accepting[i])
+
+    def recognize_many(self, sequences):
+        """Returns a list indicating, for each string in the iterable "sequences",
+        whether the automaton accepts it. If NumPy is available and all the strings
+        have the same length, they are advanced together one column at a time.
+        """
+        sequences = list(sequences)
+        lengths = set(map(len, sequences))
+        if numpy is not None and len(sequences) > 1 and len(lengths) == 1:
+            return self._recognize_columns(sequences)
+        table, k, symbol_ids = self.table, len(self.alphabet), self.symbol_ids
+        accepting, start = self.accepting, self.start
+        results = []
+        for char_sequence in sequences:
+            i = start
+            for c in char_sequence:
+                i = table[i*k+symbol_ids[c]]
+            results.append(bool(accepting[i]))
+        return results
+
+    def _recognize_columns(self, sequences):
+        """The NumPy path of recognize_many(), for equal-length strings."""
+        k, symbol_ids = len(self.alphabet), self.symbol_ids
+        table = numpy.array(self.table, dtype=numpy.intp)
+        accepting = numpy.array(list(self.accepting), dtype=bool)
+        symbols = numpy.array([[symbol_ids[c] for c in s] for s in sequences], dtype=numpy.intp)
+        current = numpy.empty(len(sequences), dtype=numpy.intp)
+        current.fill(self.start)
+        for column in range(symbols.shape[1]):
+            current = table[current*k+symbols[:, column]]
+        return accepting[current].tolist()
+
+    def scan(self, source, restart=False, chunk_size=65536):
+        """Runs the automaton over "source", which may be a string, a buffer, an mmap
+        or a file-like object with a read() method, consuming it "chunk_size" symbols
+        at a time. Yields every offset n such that the automaton is in an accepting
+        state after reading source[:n]. If "restart" is true, the automaton goes
+        back to its start state after each match.
+        """
+        table, k, symbol_ids = self.table, len(self.alphabet), self.symbol_ids
+        accepting, start = self.accepting, self.start
+        i = start
+        offset = 0
+        for chunk in _chunks(source, chunk_size):
+            for c in chunk:
+                i = table[i*k+symbol_ids[c]]
+                offset += 1
+                if accepting[i]:
+                    yield offset
+                    if restart:
+                        i = start
+
+    def matches(self, source, chunk_size=65536):
+        """Runs the automaton over "source" in a single pass, like scan(), and yields
+        a pair (offset, label) for every label of the state it is in after reading
+        source[:offset], if that state accepts; an accepting state without labels
+        yields (offset, None). To find every occurrence of a set of patterns, label
+        a DFA for each pattern p that recognizes .*p, and scan their union.
+        """
+        cursor = self.cursor()
+        for chunk in _chunks(source, chunk_size):
+            for match in cursor.matches(chunk):
+                yield match
+
+    def _reports(self):
+        """Returns, for every state, the tuple of labels that matches() reports when
+        the state is reached, computed once per automaton.
+        """
+        if self._match_reports is None:
+            if self.labels is None:
+                self._match_reports = [(None,)]*len(self.states)
+            else:
+                self._match_reports = [tuple(l) or (None,) for l in self.labels]
+        return self._match_reports
+
+    def cursor(self):
+        """Returns a new Cursor at the start state; see Cursor."""
+        return Cursor(self)
+
+    def save(self, path):
+        """Writes the automaton to a file. The format is, in order:
+         - a header: the magic string "PYDFA\\0\\0\\1", then the number of states, the number
+           of symbols and the start state as 32-bit integers, then the offsets of the
+           next three sections as 64-bit integers, all little-endian;
+         - the transition table, as little-endian 32-bit integers, 8-byte aligned;
+         - the accepting states, as a bitmap with state i in bit i%8 of byte i//8;
+         - the state and symbol names, then the symbol_ids dict if the alphabet is
+           compressed (None otherwise), then the labels if any (None otherwise), as
+           one pickled tuple.
+        """
+        n, k = len(self.states), len(self.alphabet)
+        table = array('i', self.table)
+        if sys.byteorder != 'little':
+            table.byteswap()
+        bitmap = bytearray((n+7)//8)
+        for i in range(n):
+            if self.accepting[i]:
+                bitmap[i//8] |= 1 << (i%8)
+        table_offset = (_HEADER.size+7)//8*8
+        accept_offset = table_offset + 4*n*k
+        names_offset = accept_offset + len(bitmap)
+        f = open(path, 'wb')
+        try:
+            f.write(_HEADER.pack(_MAGIC, n, k, self.start, table_offset, accept_offset, names_offset))
+            f.write('\0'*(table_offset-_HEADER.size))
+            f.write(table.tostring())
+            f.write(str(bitmap))
+            symbol_ids = None
+            if len(self.symbol_ids) != len(self.alphabet):
+                symbol_ids = self.symbol_ids
+            pickle.dump((self.states, self.alphabet, symbol_ids, self.labels), f, 2)
+        finally:
+            f.close()
+
+    @staticmethod
+    def load(path, use_mmap=True):
+        """Reads an automaton written by save(). Unless "use_mmap" is false (or the
+        machine is big-endian), the transition table is not read into memory but
+        mapped copy-on-write, so every process that loads the same file shares one
+        copy of it. The names are unpickled, so only load files from trusted sources.
+        """
+        f = open(path, 'rb')
+        try:
+            (magic, n, k, start, table_offset, accept_offset, names_offset) = \
+                _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError("%s is not a saved DFA" % path)
+            f.seek(accept_offset)
+            bitmap = bytearray(f.read(names_offset-accept_offset))
+            (states, alphabet, symbol_ids, labels) = pickle.load(f)
+            if use_mmap and sys.byteorder == 'little' and n*k:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                table = (ctypes.c_int32*(n*k)).from_buffer(buffer, table_offset)
+            else:
+                f.seek(table_offset)
+                table = array('i')
+                table.fromstring(f.read(4*n*k))
+                if sys.byteorder != 'little':
+                    table.byteswap()
+        finally:
+            f.close()
+        accepting = bytearray(n)
+        for i in range(n):
+            if bitmap[i//8] & (1 << (i%8)):
+                accepting[i] = 1
+        C = CompactDFA(states, alphabet, table, start, accepting)
+        if symbol_ids is not None:
+            C.symbol_ids = symbol_ids
+        C.labels = labels
+        return C
+
+    def to_dfa(self):
+        """Returns a DFA, over the original state and symbol names, whose delta
+        looks its transitions up in this table.
+        """
+        states, table, k = self.states, self.table, len(self.alphabet)
+        state_ids, symbol_ids = self.state_ids, self.symbol_ids
+        def delta(q, c):
+            return states[table[state_ids[q]*k+symbol_ids[c]]]
+        accepts = [states[i] for i in range(len(states)) if self.accepting[i]]
+        labels = None
+        if self.labels is not None:
+            labels = dict([(states[i], l) for (i, l) in enumerate(self.labels) if l])
+        D = DFA(states, self.alphabet, delta, states[self.start], accepts, labels)
+        if len(symbol_ids) != len(self.alphabet):
+            D.symbol_map = dict([(c, self.alphabet[j]) for (c, j) in symbol_ids.iteritems()])
+        return D
+
+    def inverse(self, states=None):
+        """Returns the inverse of the transition table as a list holding, for each
+        symbol j, a pair (offsets, sources): the states entering state i on j are
+        sources[offsets[i]:offsets[i+1]]. If "states" is given, only transitions
+        leaving those states are indexed.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        if states is None:
+            states = range(n)
+        inverse = []
+        for j in range(k):
+            offsets = array('i', [0])*(n+1)
+            for i in states:
+                offsets[table[i*k+j]+1] += 1
+            for i in range(n):
+                offsets[i+1] += offsets[i]
+            fill = array('i', offsets)
+            sources = array('i', [0])*offsets[n]
+            for i in states:
+                target = table[i*k+j]
+                sources[fill[target]] = i
+                fill[target] += 1
+            inverse.append((offsets, sources))
+        return inverse
+
+    def symbol_classes(self):
+        """Returns the classes of symbols that have the same transitions from every
+        state, as sorted lists of symbol numbers, ordered by their first member.
+        Runs in O(n*k) time.
+        """
+        k, table = len(self.alphabet), self.table
+        classes = {}
+        for j in range(k):
+            column = array('i', table[j::k]).tostring()
+            classes.setdefault(column, []).append(j)
+        return sorted(classes.values())
+
+    @_timed("compress_alphabet")
+    def compress_alphabet(self):
+        """Returns an equivalent automaton whose alphabet holds the first symbol of
+        every class of symbol_classes(), so that its table has one column per class.
+        Its symbol_ids dict still maps every original symbol, to the number of the
+        symbol's class, which is how recognizes(), scan() and the other functions
+        consuming input translate it.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        classes = self.symbol_classes()
+        representatives = [members[0] for members in classes]
+        new_table = array('i')
+        for i in range(n):
+            row = table[i*k:i*k+k]
+            new_table.extend([row[j] for j in representatives])
+        C = CompactDFA(self.states, [self.alphabet[j] for j in representatives],
+                       new_table, self.start, self.accepting)
+        class_of = array('i', [0])*k
+        for (m, members) in enumerate(classes):
+            for j in members:
+                class_of[j] = m
+        C.symbol_ids = dict([(c, class_of[j]) for (c, j) in self.symbol_ids.iteritems()])
+        return C
+
+    def bfs(self, sources, stop=None):
+        """Breadth-first search of the transition graph from the states in the list
+        "sources". Returns a pair (distances, found): distances[i] is the length of
+        the shortest path from a source to state i, or None if i was not reached. If
+        "stop" is given, the search ends at the first state i reached for which
+        stop(i) is true, which is returned as "found" (None otherwise); distances is
+        then only filled in for the states reached so far.
+        """
+        k, table = len(self.alphabet), self.table
+        distances = [None]*len(self.states)
+        queue = deque()
+        for i in sources:
+            if distances[i] is None:
+                distances[i] = 0
+                if stop is not None and stop(i):
+                    return (distances, i)
+                queue.append(i)
+        while queue:
+            i = queue.popleft()
+            distance = distances[i] + 1
+            for next in table[i*k:i*k+k]:
+                if distances[next] is None:
+                    distances[next] = distance
+                    if stop is not None and stop(next):
+                        return (distances, next)
+                    queue.append(next)
+        return (distances, None)
+
+    def dfs(self, sources, stop=None):
+        """Depth-first search of the transition graph from the states in the list
+        "sources". Returns a pair (reached, found), where reached is a bytearray
+        with reached[i] == 1 iff state i was reached, and "stop" and "found" are as
+        in bfs().
+        """
+        k, table = len(self.alphabet), self.table
+        reached = bytearray(len(self.states))
+        stack = []
+        for i in sources:
+            if not reached[i]:
+                reached[i] = 1
+                if stop is not None and stop(i):
+                    return (reached, i)
+                stack.append(i)
+        while stack:
+            base = stack.pop()*k
+            for next in table[base:base+k]:
+                if not reached[next]:
+                    reached[next] = 1
+                    if stop is not None and stop(next):
+                        return (reached, next)
+                    stack.append(next)
+        return (reached, None)
+
+    def reachable_from(self, i0, inclusive=True):
+        """Returns the sorted list of states reachable from state i0. The optional
+        parameter "inclusive" indicates that i0 should always be included.
+        """
+        k = len(self.alphabet)
+        if inclusive:
+            sources = [i0]
+        else:
+            sources = self.table[i0*k:i0*k+k]
+        (reached, found) = self.dfs(sources)
+        return [i for i in range(len(self.states)) if reached[i]]
+
+    def levels(self):
+        """Returns a list holding each state's distance from the start state, or
+        None for the unreachable states.
+        """
+        return self.bfs([self.start])[0]
+
+    @_timed("hopcroft_classes")
+    def hopcroft_classes(self, states=None, initial=None):
+        """Returns a partition of the states into Myhill-Nerode equivalence classes,
+        as lists of state numbers, using Hopcroft's O(n*logn) algorithm. If "states"
+        is given, only that subset is partitioned; it must be closed under delta.
+        States start out split by acceptance (and labels), or, if the list "initial"
+        is given, by their values in it, so that only states with equal values can
+        share a class.
+        """
+        k = len(self.alphabet)
+        if states is None:
+            states = range(len(self.states))
+        if initial is None:
+            initial = self.accepting
+            if self.labels is not None:
+                initial = zip(self.accepting, self.labels)
+        #Step 1: Index the inverse transitions
+        inverse = self.inverse(states)
+        #Step 2: Build the initial partition
+        groups = {}
+        for i in states:
+            groups.setdefault(initial[i], set()).add(i)
+        blocks = groups.values()
+        block_of = {}
+        for (b, block) in enumerate(blocks):
+            for i in block:
+                block_of[i] = b
+        #Step 3: Refine against the splitters on the worklist. Only the smaller
+        # half of each split needs to be (re)added -- this gives the log factor.
+        # Initially, every block but the largest is a splitter.
+        worklist = []
+        if len(blocks) > 1:
+            largest = max(range(len(blocks)), key=lambda b: len(blocks[b]))
+            worklist = [(b, j) for b in range(len(blocks)) if b != largest for j in range(k)]
+        pending = set(worklist)
+        while len(worklist):
+            splitter = worklist.pop()
+            pending.remove(splitter)
+            (b, j) = splitter
+            (offsets, sources) = inverse[j]
+            touched = {}
+            for i in blocks[b]:
+                for pred in sources[offsets[i]:offsets[i+1]]:
+                    touched.setdefault(block_of[pred], set()).add(pred)
+            for (y, hit) in touched.iteritems():
+                if len(hit) == len(blocks[y]):
+                    continue
+                blocks[y] -= hit
+                new = len(blocks)
+                blocks.append(hit)
+                for i in hit:
+                    block_of[i] = new
+                for d in range(k):
+                    if (y, d) in pending or len(hit) <= len(blocks[y]):
+                        add = (new, d)
+                    else:
+                        add = (y, d)
+                    worklist.append(add)
+                    pending.add(add)
+                if _profilers:
+                    _record_round("hopcroft_classes", len(blocks))
+        return [sorted(block) for block in blocks]
+
+    def quotient(self, classes):
+        """Returns the automaton obtained by collapsing every class in "classes" -- a
+        list of lists of state numbers, such as hopcroft_classes() returns -- into a
+        single state, named after the class's first member. The classes must cover
+        the start state and everything reachable from it, and states in one class
+        must agree on acceptance and go to the same class on every symbol.
+        """
+        k, table = len(self.alphabet), self.table
+        class_of = {}
+        for (c, members) in enumerate(classes):
+            for i in members:
+                class_of[i] = c
+        new_table = array('i')
+        accepting = bytearray(len(classes))
+        for (c, members) in enumerate(classes):
+            i = members[0]
+            accepting[c] = self.accepting[i]
+            for next in table[i*k:i*k+k]:
+                new_table.append(class_of[next])
+        states = [self.states[members[0]] for members in classes]
+        Q = CompactDFA(states, self.alphabet, new_table, class_of[self.start], accepting)
+        Q.symbol_ids = self.symbol_ids
+        if self.labels is not None:
+            Q.labels = [self.labels[members[0]] for members in classes]
+        return Q
+
+    @_timed("sccs")
+    def sccs(self):
+        """Returns the strongly connected components of the transition graph, as
+        lists of state numbers, using an iterative version of Tarjan's algorithm.
+        Every component is listed after all the components reachable from it.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        index = array('i', [-1])*n
+        low = array('i', [0])*n
+        on_stack = bytearray(n)
+        stack = []
+        components = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, 0)]
+            while len(work):
+                (v, j) = work[-1]
+                if j < k:
+                    work[-1] = (v, j+1)
+                    w = table[v*k+j]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append((w, 0))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                work.pop()
+                if len(work) and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+        return components
+
+    def is_cyclic(self, component):
+        """Indicates whether a strongly connected component, as returned by sccs(),
+        contains a cycle -- that is, whether it has several states or a self-loop.
+        """
+        k = len(self.alphabet)
+        i = component[0]
+        return len(component) > 1 or i in self.table[i*k:i*k+k]
+
+    def is_finite(self):
+        """Indicates whether the automaton's language is a finite set: that is,
+        whether no cycle is both reachable and able to reach an accepting state.
+        """
+        k, table = len(self.alphabet), self.table
+        reached = self.dfs([self.start])[0]
+        live = bytearray(len(self.states))
+        for component in self.sccs():
+            alive = False
+            for i in component:
+                if self.accepting[i] or any([live[next] for next in table[i*k:i*k+k]]):
+                    alive = True
+                    break
+            if alive:
+                if reached[component[0]] and self.is_cyclic(component):
+                    return False
+                for i in component:
+                    live[i] = 1
+        return True
+
+    @_timed("cover_leaders")
+    def cover_leaders(self, l):
+        """Only for minimized automata accepting a finite language whose longest word
+        has length l. Returns a list mapping each state to the state it is merged into
+        by cover-automaton minimization (or to itself).
+
+        States p and q are similar if no word of length at most l-max(level(p), level(q))
+        distinguishes them. With the states sorted by level, each one is merged into the
+        first state of its block in the partition into classes of words of that length,
+        so the blocks are only needed one round at a time. They are refined Moore-round
+        by Moore-round, as in Korner's algorithm: only the predecessors of states that
+        moved in the previous round are re-examined, and the largest piece of every split
+        keeps its place, so each state moves O(logn) times. Every block is a range of an
+        array with its touched states at the front, which leaves an untouched member at
+        hand, and keeps its members sorted by level in a list whose first live entry is
+        the block's first state. This runs in O(k^2*n*logn) time.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        inverse = self.inverse()
+        levels = self.levels()
+        order = sorted(range(n), key=lambda i: levels[i])
+        position = array('i', [0])*n
+        for (x, i) in enumerate(order):
+            position[i] = x
+        #Step 1: Bucket the states by the round at which they are due
+        due = {}
+        for i in range(n):
+            due.setdefault(max(l - levels[i], -1), []).append(i)
+        leaders = range(n)
+        if -1 in due:
+            for i in due[-1]:
+                leaders[i] = order[0]
+        #Step 2: Start from the partition into accepting and rejecting states.
+        # Block b is elements[start[b]:end[b]], whose first marked[b] states were
+        # touched this round; by_level[b] holds its members (and past members) in
+        # order of level, and head[b] indexes the first one still in the block.
+        block_of = array('i', [0])*n
+        elements = array('i')
+        where = array('i', [0])*n
+        start, end, marked, by_level, head = [], [], [], [], []
+        for accepting in [1, 0]:
+            block = [i for i in order if self.accepting[i] == accepting]
+            if len(block):
+                start.append(len(elements))
+                for i in block:
+                    block_of[i] = len(by_level)
+                    where[i] = len(elements)
+                    elements.append(i)
+                end.append(len(elements))
+                marked.append(0)
+                by_level.append(block)
+                head.append(0)
+        def signature(i):
+            return tuple([block_of[next] for next in table[i*k:i*k+k]])
+        moved = range(n)
+        #Step 3: Process the rounds, refining in between
+        for round in range(l+1):
+            if round > 0 and len(moved):
+                touched = []
+                for i in moved:
+                    for (offsets, sources) in inverse:
+                        for pred in sources[offsets[i]:offsets[i+1]]:
+                            b = block_of[pred]
+                            front = start[b] + marked[b]
+                            if where[pred] >= front:
+                                #Swap pred to the front of its block and mark it
+                                other = elements[front]
+                                (elements[front], elements[where[pred]]) = (pred, other)
+                                (where[other], where[pred]) = (where[pred], front)
+                                if not marked[b]:
+                                    touched.append(b)
+                                marked[b] += 1
+                splits = []
+                for b in touched:
+                    groups = {}
+                    for i in elements[start[b]:start[b]+marked[b]]:
+                        groups.setdefault(signature(i), []).append(i)
+                    #The states that were not touched all share one signature, so
+                    # the touched states with that signature stay with them
+                    last = []
+                    if start[b] + marked[b] < end[b]:
+                        last = groups.pop(signature(elements[start[b]+marked[b]]), [])
+                    pieces = groups.values()
+                    if len(pieces) + (len(last) + end[b] - start[b] - marked[b] > 0) > 1:
+                        splits.append((b, pieces, last))
+                    marked[b] = 0
+                moved = []
+                for (b, pieces, last) in splits:
+                    #Lay the pieces out in b's range, with the piece holding the
+                    # untouched states last; the largest piece keeps b's number
+                    pos = start[b]
+                    ranges = []
+                    for group in pieces + [last]:
+                        ranges.append(pos)
+                        for i in group:
+                            elements[pos] = i
+                            where[i] = pos
+                            pos += 1
+                    ranges.append(end[b])
+                    if ranges[-2] == end[b]:
+                        ranges.pop()
+                    spans = [(ranges[x], ranges[x+1]) for x in range(len(ranges)-1)]
+                    largest = max(spans, key=lambda (lo, hi): hi - lo)
+                    for (lo, hi) in spans:
+                        if (lo, hi) == largest:
+                            (start[b], end[b]) = (lo, hi)
+                            continue
+                        group = elements[lo:hi]
+                        for i in group:
+                            block_of[i] = len(by_level)
+                        start.append(lo)
+                        end.append(hi)
+                        marked.append(0)
+                        by_level.append(sorted(group, key=position.__getitem__))
+                        head.append(0)
+                        moved.extend(group)
+            if _profilers:
+                _record_round("cover_leaders", len(by_level))
+            for i in due.get(round, []):
+                b = block_of[i]
+                members, h = by_level[b], head[b]
+                while block_of[members[h]] != b:
+                    h += 1
+                head[b] = h
+                leaders[i] = members[h]
+        return leaders
+
+    @_timed("almost_equivalence_classes")
+    def almost_equivalence_classes(self):
+        """Only for minimized automata. Returns the partition of the states into
+        classes of states whose languages differ in finitely many words, as lists of
+        state numbers. In a minimized automaton these are the states that agree on
+        all sufficiently long words, i.e. the coarsest partition such that states in
+        a block go to the same block on every symbol.
+
+        This is the O(n*logn) algorithm from "An nlogn Algorithm for Hyper-minimizing
+        a (Minimized) Deterministic Automaton" (Holzer and Maletti): states are hashed
+        by the blocks of their successors, every collision merges two blocks, and the
+        predecessors of the smaller block are rehashed.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        inverse = self.inverse()
+        block = array('i', range(n))
+        members = [[i] for i in range(n)]
+        seen = {}
+        queue = range(n)
+        queued = bytearray([1])*n
+        while len(queue):
+            q = queue.pop()
+            queued[q] = 0
+            successors = tuple([block[next] for next in table[q*k:q*k+k]])
+            p = seen.get(successors)
+            if p is not None and block[p] != block[q]:
+                (small, large) = (block[p], block[q])
+                if len(members[small]) > len(members[large]):
+                    (small, large) = (large, small)
+                for r in members[small]:
+                    for (offsets, sources) in inverse:
+                        for pred in sources[offsets[r]:offsets[r+1]]:
+                            if not queued[pred]:
+                                queued[pred] = 1
+                                queue.append(pred)
+                for r in members[small]:
+                    block[r] = large
+                members[large].extend(members[small])
+                members[small] = None
+            seen[successors] = q
+        classes = [sorted(m) for m in members if m is not None]
+        _record_round("almost_equivalence_classes", len(classes))
+        return classes
+
+    def pluck_leaves(self):
+        """Only for minimized automata. Returns a topologically ordered list of
+        all the states that induce a finite language. Runs in linear time.
+        """
+        n, k, table = len(self.states), len(self.alphabet), self.table
+        inverse = self.inverse()
+        #Step 1: Count the outbound edges; sink states are plucked first
+        outbound = array('i', [k])*n
+        to_pluck = []
+        for i in range(n):
+            if not self.accepting[i] and table[i*k:i*k+k].count(i) == k:
+                to_pluck.append(i)
+        #Step 2: Pluck!
+        plucked = []
+        while len(to_pluck):
+            i = to_pluck.pop()
+            plucked.append(i)
+            for (offsets, sources) in inverse:
+                for incoming in sources[offsets[i]:offsets[i+1]]:
+                    outbound[incoming] -= 1
+                    if outbound[incoming] == 0 and incoming != i:
+                        to_pluck.append(incoming)
+        plucked.reverse()
+        return plucked
+
+    #The finite-language operations below are dynamic programs over the
+    # topological order from pluck_leaves(), so they only apply to minimized
+    # automata, for which that order includes the start state iff the
+    # language is finite.
+
+    def _longest_lengths(self):
+        """Returns the topological order of pluck_leaves() and a list holding, for
+        each state in it, the length of the longest word its language contains
+        (None for the sink). The other states are None too.
+        """
+        k, table = len(self.alphabet), self.table
+        order = self.pluck_leaves()
+        longest = [None]*len(self.states)
+        for i in reversed(order):
+            length = None
+            if self.accepting[i]:
+                length = 0
+            for next in table[i*k:i*k+k]:
+                if longest[next] is not None and (length is None or longest[next] + 1 > length):
+                    length = longest[next] + 1
+            longest[i] = length
+        assert(self.start in order)
+        return (order, longest)
+
+    def longest_word_length(self):
+        """Only for minimized automata accepting a finite language. Returns the length
+        of the longest word in the language, or None if the language is empty.
+        Runs in O(n*k) time.
+        """
+        return self._longest_lengths()[1][self.start]
+
+    @_timed("length_counts")
+    def length_counts(self):
+        """Only for minimized automata accepting a finite language. Returns a list
+        whose m-th item is the number of words of length m in the language, up to
+        the longest word. Runs in O(n*k*l) time, where l is that length. If the
+        alphabet is compressed, each transition counts once for every symbol of
+        its class.
+        """
+        k, table = len(self.alphabet), self.table
+        weights = [0]*k
+        for j in self.symbol_ids.itervalues():
+            weights[j] += 1
+        (order, longest) = self._longest_lengths()
+        counts = {}
+        for i in reversed(order):
+            if longest[i] is None:
+                continue
+            count = [0]*(longest[i]+1)
+            count[0] = self.accepting[i]
+            for (j, next) in enumerate(table[i*k:i*k+k]):
+                if longest[next] is not None:
+                    weight = weights[j]
+                    for (m, c) in enumerate(counts[next]):
+                        count[m+1] += weight*c
+            counts[i] = count
+        return counts.get(self.start, [])
+
+    def words(self):
+        """Only for minimized automata accepting a finite language. Yields the words
+        of the language, as lists of symbols, in lexicographic order. Only the
+        transitions to states with a nonempty language are followed, so every word
+        costs at most O(k) steps per symbol. If the alphabet is compressed, every
+        class is expanded back into its symbols.
+        """
+        k, table = len(self.alphabet), self.table
+        longest = self._longest_lengths()[1]
+        if longest[self.start] is None:
+            return
+        #(symbol, column) for every input symbol, in the order words are produced
+        symbols = sorted(self.symbol_ids.iteritems())
+        word = []
+        if self.accepting[self.start]:
+            yield []
+        #(state, position in "symbols" of the next transition to follow)
+        stack = [(self.start, 0)]
+        while stack:
+            (i, x) = stack[-1]
+            if x == len(symbols):
+                stack.pop()
+                if stack:
+                    word.pop()
+                continue
+            stack[-1] = (i, x+1)
+            (c, j) = symbols[x]
+            next = table[i*k+j]
+            if longest[next] is None:
+                continue
+            word.append(c)
+            stack.append((next, 0))
+            if self.accepting[next]:
+                yield list(word)
+
+#
+# Cursors: per-stream reading positions in a shared CompactDFA
+#
+
+class Cursor(object):
+    """The state of one input stream being read by a CompactDFA. A cursor holds only
+    a reference to the automaton, a state number and an offset; the automaton is
+    never modified by reading, so any number of cursors (for instance, one per
+    network connection) can share one table without locks or copies.
+
+    Input is pushed in with feed() or matches(), one chunk at a time, as it
+    arrives. In an event loop, call one of them from the callback that receives
+    the data; in a coroutine, from the loop that awaits the next chunk of the
+    stream (e.g. "chunk = await reader.read(65536)" under asyncio).
+    """
+    __slots__ = ('automaton', 'state', 'offset')
+
+    def __init__(self, automaton):
+        self.automaton = automaton
+        self.state = automaton.start
+        self.offset = 0
+
+    def feed(self, chunk):
+        """Advances the cursor over a chunk of symbols. Returns whether the
+        automaton accepts the input read so far.
+        """
+        C = self.automaton
+        table, k, symbol_ids = C.table, len(C.alphabet), C.symbol_ids
+        i = self.state
+        for c in chunk:
+            i = table[i*k+symbol_ids[c]]
+        self.state = i
+        self.offset += len(chunk)
+        return bool(C.accepting[i])
+
+    def matches(self, chunk):
+        """Advances the cursor over a chunk of symbols, and returns the list of
+        (offset, label) pairs that CompactDFA.matches() reports within it, with
+        offsets counted from the start of the stream.
+        """
+        C = self.automaton
+        table, k, symbol_ids, accepting = C.table, len(C.alphabet), C.symbol_ids, C.accepting
+        reports = C._reports()
+        found = []
+        i = self.state
+        offset = self.offset
+        for c in chunk:
+            i = table[i*k+symbol_ids[c]]
+            offset += 1
+            if accepting[i]:
+                for label in reports[i]:
+                    found.append((offset, label))
+        self.state = i
+        self.offset = offset
+        return found
+
+    def status(self):
+        """Indicates whether the automaton accepts the input read so far."""
+        return bool(self.automaton.accepting[self.state])
+
+    def labels(self):
+        """Returns the labels of the current state."""
+        if self.automaton.labels is None:
+            return _NO_LABELS
+        return self.automaton.labels[self.state]
+
+    def reset(self):
+        """Returns the cursor to the start state and offset 0."""
+        self.state = self.automaton.start
+        self.offset = 0
+
+    def copy(self):
+        """Returns an independent cursor at the same position."""
+        other = Cursor(self.automaton)
+        other.state = self.state
+        other.offset = self.offset
+        return other
+
+def _chunks(source, chunk_size):
+    """Yields successive pieces of at most "chunk_size" symbols from anything that
+    supports len() and slicing, such as a string or an mmap, or else from a file-like
+    object. Sliced sources are always read from the beginning, so an mmap can be
+    scanned any number of times regardless of its file position.
+    """
+    if hasattr(source, '__len__') and hasattr(source, '__getitem__'):
+        for pos in xrange(0, len(source), chunk_size):
+            yield source[pos:pos+chunk_size]
+    else:
+        while True:
+            chunk = source.read(chunk_size)
+            if not len(chunk):
+                return
+            yield chunk
+
+#
+# Boolean set operations on languages
+#
+
+@_timed("cross_product")
+def cross_product(D1, D2, accept_method, lazy=False):
     """A generalized cross-product constructor over two DFAs. 
     The third argument is a binary boolean function f; a state (q1, q2) in the final
     DFA accepts if f(A[q1],A[q2]), where A indicates the acceptance-value of the state.
+    An accepting state's labels are the union of the labels of q1 and q2.
+    If the optional "lazy" parameter is true, only the pairs reachable from
+    (D1.start, D2.start) are built, so the result is smaller but not "complete".
     """
     assert(D1.alphabet == D2.alphabet)
+    C1, C2 = D1.compile(), D2.compile()
+    _product_symbol_ids([C1, C2])
+    if lazy:
+        C = _lazy_product(C1, C2, accept_method)
+        _record_product("cross_product", len(C.states))
+        return C.to_dfa()
+    k = len(C1.alphabet)
     states = []
-    for s1 in D1.states:
-        for s2 in D2.states:
+    for s1 in C1.states:
+        for s2 in C2.states:
             states.append((s1,s2))
     start = (D1.start, D2.start)
     def delta(state_pair, char):
-        next_D1 = D1.delta(state_pair[0], char)
-        next_D2 = D2.delta(state_pair[1], char)
-        return (next_D1, next_D2)
+        next_D1 = C1.table[C1.state_ids[state_pair[0]]*k+C1.symbol_ids[char]]
+        next_D2 = C2.table[C2.state_ids[state_pair[1]]*k+C2.symbol_ids[char]]
+        return (C1.states[next_D1], C2.states[next_D2])
     alphabet = copy(D1.alphabet)
     accepts = []
-    for (s1, s2) in states:
-        a1 = s1 in D1.accepts
-        a2 = s2 in D2.accepts
-        if accept_method(a1, a2):
-            accepts.append((s1, s2))
-    return DFA(states=states, start=start, delta=delta, accepts=accepts, alphabet=alphabet)
-
-def intersection(D1, D2):
+    for (i1, s1) in enumerate(C1.states):
+        a1 = bool(C1.accepting[i1])
+        for (i2, s2) in enumerate(C2.states):
+            a2 = bool(C2.accepting[i2])
+            if accept_method(a1, a2):
+                accepts.append((s1, s2))
+    labels = None
+    if C1.labels is not None or C2.labels is not None:
+        labels = {}
+        for (s1, s2) in accepts:
+            labels[(s1, s2)] = D1.labels_of(s1) | D2.labels_of(s2)
+    _record_product("cross_product", len(states))
+    D = DFA(states=states, start=start, delta=delta, accepts=accepts, alphabet=alphabet, labels=labels)
+    D.symbol_map = D1.symbol_map
+    return D
+
+def _lazy_product(C1, C2, accept_method):
+    """Builds the part of the cross product of two CompactDFAs that is reachable
+    from the pair of start states, breadth-first. Returns a CompactDFA whose states
+    are named by pairs of original state names, numbered in discovery order.
+    """
+    k = len(C1.alphabet)
+    symbol_map = [C2.symbol_ids[c] for c in C1.alphabet]
+    table1, table2 = C1.table, C2.table
+    start = (C1.start, C2.start)
+    ids = {start: 0}
+    pairs = [start]
+    table = array('i')
+    accepting = bytearray()
+    pos = 0
+    while pos < len(pairs):
+        (i1, i2) = pairs[pos]
+        pos += 1
+        accepting.append(int(bool(accept_method(bool(C1.accepting[i1]), bool(C2.accepting[i2])))))
+        for j in range(k):
+            pair = (table1[i1*k+j], table2[i2*k+symbol_map[j]])
+            next = ids.get(pair)
+            if next is None:
+                next = ids[pair] = len(pairs)
+                pairs.append(pair)
+            table.append(next)
+    states = [(C1.states[i1], C2.states[i2]) for (i1, i2) in pairs]
+    C = CompactDFA(states, list(C1.alphabet), table, 0, accepting)
+    C.symbol_ids = C1.symbol_ids
+    C.labels = _product_labels([C1, C2], pairs, accepting)
+    return C
+
+def _product_symbol_ids(automata):
+    """Returns the symbol_ids dict of a product of the CompactDFAs in "automata" whose
+    columns are those of the first one, which is its own. If the alphabets are
+    compressed, this requires every symbol class of the first automaton to lie within
+    one class of each of the others; otherwise a ValueError is raised, and the product
+    should be taken before compressing.
+    """
+    first = automata[0]
+    for C in automata[1:]:
+        if len(C.symbol_ids) != len(first.symbol_ids):
+            raise ValueError("the automata do not read the same input symbols")
+        for (c, j) in first.symbol_ids.iteritems():
+            if C.symbol_ids.get(c) != C.symbol_ids[first.alphabet[j]]:
+                raise ValueError("the automata were compressed into different symbol classes; "
+                                 "compress their product instead")
+    return first.symbol_ids
+
+def _product_labels(automata, tuples, accepting):
+    """Returns the labels of the product states given as tuples of state numbers,
+    one per CompactDFA in "automata": the union of their components' labels for
+    the accepting ones. Returns None if none of the automata has labels.
+    """
+    labeled = [(t, C.labels) for (t, C) in enumerate(automata) if C.labels is not None]
+    if not labeled:
+        return None
+    labels = []
+    for (s, a) in zip(tuples, accepting):
+        l = _NO_LABELS
+        if a:
+            for (t, component_labels) in labeled:
+                l = l | component_labels[s[t]]
+        labels.append(l)
+    return labels
+
+@_timed("product_all")
+def product_all(automata, accept_method=all, minimize=False):
+    """Constructs a DFA for the cross product of any number of DFAs in a single pass,
+    instead of nesting binary products. A state (q1, ..., qk) accepts if accept_method
+    returns true for the tuple (A[q1], ..., A[qk]) of the states' acceptance-values;
+    for example all() gives the intersection and any() the union. States are flat
+    tuples of the original state names, and only those reachable from the tuple of
+    start states are built.
+
+    If "minimize" is true, the product is instead built one automaton at a time, and
+    every intermediate product is minimized with respect to the vectors of acceptance-
+    values, which keeps it small. States are then named by representative tuples.
+    An accepting state's labels are the union of the labels of its components.
+    """
+    compiled = [D.compile() for D in automata]
+    assert(len(compiled))
+    alphabet = compiled[0].alphabet
+    for C in compiled[1:]:
+        assert(set(C.alphabet) == set(alphabet))
+    symbol_ids = _product_symbol_ids(compiled)
+    k = len(alphabet)
+    if not minimize:
+        steps = [compiled]
+    else:
+        steps = [[C] for C in compiled]
+    #Each step multiplies the current product (names, table, vectors) by some
+    # automata, breadth-first, with every state numbered in discovery order.
+    names, table, vectors = [()], array('i', [0])*k, [()]
+    labeled = [C for C in compiled if C.labels is not None]
+    label_sets = [_NO_LABELS]
+    for step in steps:
+        tables = [C.table for C in step]
+        symbol_maps = [[C.symbol_ids[c] for c in alphabet] for C in step]
+        start = (0,) + tuple([C.start for C in step])
+        ids = {start: 0}
+        order = [start]
+        new_table = array('i')
+        pos = 0
+        while pos < len(order):
+            current = order[pos]
+            pos += 1
+            for j in range(k):
+                next = (table[current[0]*k+j],)
+                for (t, (T, symbol_map)) in enumerate(zip(tables, symbol_maps)):
+                    next += (T[current[t+1]*k+symbol_map[j]],)
+                if next not in ids:
+                    ids[next] = len(order)
+                    order.append(next)
+                new_table.append(ids[next])
+        names = [names[s[0]] + tuple([C.states[i] for (C, i) in zip(step, s[1:])]) for s in order]
+        vectors = [vectors[s[0]] + tuple([bool(C.accepting[i]) for (C, i) in zip(step, s[1:])]) for s in order]
+        if labeled:
+            new_label_sets = []
+            for s in order:
+                l = label_sets[s[0]]
+                for (C, i) in zip(step, s[1:]):
+                    if C.labels is not None:
+                        l = l | C.labels[i]
+                new_label_sets.append(l)
+            label_sets = new_label_sets
+        table = new_table
+        if minimize:
+            P = CompactDFA(names, alphabet, table, 0, bytearray(len(names)))
+            initial = vectors
+            if labeled:
+                initial = zip(vectors, label_sets)
+            classes = P.hopcroft_classes(initial=initial)
+            classes.sort() #puts the start state's class first, keeping it number 0
+            P = P.quotient(classes)
+            (names, table) = (P.states, P.table)
+            vectors = [vectors[members[0]] for members in classes]
+            if labeled:
+                label_sets = [label_sets[members[0]] for members in classes]
+    _record_product("product_all", len(names))
+    accepting = bytearray([int(bool(accept_method(v))) for v in vectors])
+    C = CompactDFA(names, list(alphabet), table, 0, accepting)
+    C.symbol_ids = symbol_ids
+    if labeled:
+        C.labels = [a and l or _NO_LABELS for (a, l) in zip(accepting, label_sets)]
+    return C.to_dfa()
+
+def intersection(D1, D2, lazy=False):
     """Constructs an unminimized DFA recognizing the intersection of the languages of two given DFAs."""
     f = bool.__and__
-    return cross_product(D1, D2, f)
+    return cross_product(D1, D2, f, lazy)
 
-def union(D1, D2):
+def union(D1, D2, lazy=False):
     """Constructs an unminimized DFA recognizing the union of the languages of two given DFAs."""
     f = bool.__or__
-    return cross_product(D1, D2, f)
+    return cross_product(D1, D2, f, lazy)
 
-def symmetric_difference(D1, D2):
+def symmetric_difference(D1, D2, lazy=False):
     """Constructs an unminimized DFA recognizing the symmetric difference of the languages of two given DFAs."""
     f = bool.__xor__
-    return cross_product(D1, D2, f)
+    return cross_product(D1, D2, f, lazy)
 
 def inverse(D):
     """Constructs an unminimized DFA recognizing the inverse of the language of a given DFA."""
@@ -577,6 +2335,70 @@ def inverse(D):
             new_accepts.append(state)
     return DFA(states=D.states, start=D.start, delta=D.delta, accepts=new_accepts, alphabet=D.alphabet)
 
+#
+# Decision procedures on languages
+#
+
+@_timed("distinguishing_word")
+def distinguishing_word(D1, D2, accept_method=bool.__xor__):
+    """Returns a shortest word w, as a list of symbols, such that f(A1(w), A2(w)) holds,
+    where f is the binary boolean function "accept_method" and Ai(w) indicates whether Di
+    accepts w. Returns None if there is no such word. By default f is xor, so the word
+    distinguishes the two DFAs. Only the reachable part of the cross product is searched,
+    and the search stops at the first pair of states that satisfies f.
+    """
+    assert(D1.alphabet == D2.alphabet)
+    C1, C2 = D1.compile(), D2.compile()
+    _product_symbol_ids([C1, C2])
+    k = len(C1.alphabet)
+    symbol_map = [C2.symbol_ids[c] for c in C1.alphabet]
+    start = (C1.start, C2.start)
+    parent = {start: None}
+    queue = [start]
+    pos = 0
+    while pos < len(queue):
+        pair = queue[pos]
+        pos += 1
+        (i1, i2) = pair
+        if accept_method(bool(C1.accepting[i1]), bool(C2.accepting[i2])):
+            word = []
+            while parent[pair] is not None:
+                (pair, j) = parent[pair]
+                word.append(C1.alphabet[j])
+            word.reverse()
+            _record_product("distinguishing_word", len(parent))
+            return word
+        for j in range(k):
+            next = (C1.table[i1*k+j], C2.table[i2*k+symbol_map[j]])
+            if next not in parent:
+                parent[next] = (pair, j)
+                queue.append(next)
+    _record_product("distinguishing_word", len(parent))
+    return None
+
+def shortest_word(D):
+    """Returns a shortest word accepted by D, as a list of symbols, or None if
+    the language of D is empty.
+    """
+    return distinguishing_word(D, D, lambda a1, a2: a1)
+
+def is_empty(D):
+    """Indicates whether the language of D is empty."""
+    return shortest_word(D) is None
+
+def equivalent(D1, D2):
+    """Indicates whether two DFAs recognize the same language. Use
+    distinguishing_word() to get a shortest counterexample.
+    """
+    return distinguishing_word(D1, D2) is None
+
+def is_subset(D1, D2):
+    """Indicates whether the language of D1 is a subset of the language of D2. Use
+    distinguishing_word(D1, D2, lambda a1, a2: a1 and not a2) to get a shortest
+    counterexample.
+    """
+    return distinguishing_word(D1, D2, lambda a1, a2: a1 and not a2) is None
+
 # 
 # Constructing new DFAs
 # 
@@ -586,13 +2408,11 @@ def from_word_list(language, alphabet):
     accepts = language
     start = ''
     sink = 'sink'
-    states = [start, sink]
+    states = set([start, sink])
     for word in language:
         for i in range(len(word)):
-            prefix = word[:i+1]
-            if prefix not in states:
-                states.append(prefix)
-    fwl = copy(states)
+            states.add(word[:i+1])
+    fwl = frozenset(states)
     def delta(q, c):
         next = q+c
         if next in fwl:
@@ -601,6 +2421,90 @@ def from_word_list(language, alphabet):
             return sink
     return DFA(states=states, alphabet=alphabet, delta=delta, start=start, accepts=accepts)
 
+def minimal_from_word_list(language, alphabet, presorted=False):
+    """Constructs the minimal DFA accepting the given finite language, using the incremental
+    algorithm of Daciuk, Mihov, Watson and Watson for sorted input ("Incremental Construction
+    of Minimal Acyclic Finite-State Automata"). Only the path of the most recently added word
+    is ever left unminimized, so the full trie is never built, and the ids of replaced states
+    are reused, so memory stays proportional to the minimal DFA plus the longest word. States
+    are integers, with the start state numbered 0, and delta is backed by a CompactDFA table.
+
+    Unless "presorted" is true, the words are sorted first. If it is, "language" may be any
+    iterable producing the words in lexicographic order, such as an open file of stripped lines.
+    """
+    alphabet = list(alphabet)
+    symbols = set(alphabet)
+    if not presorted:
+        language = sorted(language)
+    transitions = [{}]
+    final = [False]
+    free = [] #ids of replaced states, to be reused
+    register = {}
+    unchecked = [] #(parent, symbol, child) along the path of the last word
+    def replace_or_register(depth):
+        while len(unchecked) > depth:
+            (parent, symbol, child) = unchecked.pop()
+            key = (final[child], tuple(sorted(transitions[child].iteritems())))
+            if key in register:
+                transitions[parent][symbol] = register[key]
+                transitions[child] = None
+                free.append(child)
+            else:
+                register[key] = child
+    previous = None
+    for word in language:
+        if previous is not None:
+            assert(previous <= word)
+        common = 0
+        if previous is not None:
+            for (a, b) in zip(previous, word):
+                if a != b:
+                    break
+                common += 1
+        replace_or_register(common)
+        if len(unchecked):
+            state = unchecked[-1][2]
+        else:
+            state = 0
+        for symbol in word[common:]:
+            assert(symbol in symbols)
+            if len(free):
+                child = free.pop()
+                transitions[child] = {}
+                final[child] = False
+            else:
+                child = len(transitions)
+                transitions.append({})
+                final.append(False)
+            transitions[state][symbol] = child
+            unchecked.append((state, symbol, child))
+            state = child
+        final[state] = True
+        previous = word
+    replace_or_register(0)
+    #Number the states breadth-first and add a sink state to complete delta
+    ids = {0: 0}
+    order = [0]
+    pos = 0
+    while pos < len(order):
+        for child in transitions[order[pos]].itervalues():
+            if child not in ids:
+                ids[child] = len(order)
+                order.append(child)
+        pos += 1
+    if final[0] or len(transitions[0]):
+        sink = len(order)
+        accepting = bytearray([final[q] for q in order] + [0])
+    else:
+        sink = 0
+        accepting = bytearray([0])
+    table = array('i')
+    for q in order[:sink]:
+        for c in alphabet:
+            table.append(ids.get(transitions[q].get(c), sink))
+    table.extend([sink]*len(alphabet))
+    return CompactDFA(range(len(accepting)), alphabet, table, 0, accepting).to_dfa()
+
 def modular_zero(n, base=2):
     """Returns a DFA that accepts all binary numbers equal to 0 mod n. Use the optional
     parameter "base" if you want something other than binary. The empty string is also 
@@ -636,11 +2540,12 @@ def random(states_size, alphabet_size, acceptance=0.5):
 # Finite-factoring
 # 
 
+@_timed("finite_factor")
 def finite_factor(self):
     D1 = self.copy()
     D1.minimize()
     D2 = D1.copy()
     D2.hyper_minimize()
-    D3 = symmetric_difference(D1, D2)
+    D3 = symmetric_difference(D1, D2, lazy=True)
     l = D3.DFCA_minimize()
     return (D2, (D3, l))
@@ -0,0 +1,331 @@
+"""Nondeterministic finite automata and regular expressions, as a front-end to DFA.
+
+An NFA can be determinized into a DFA all at once with determinize(), which may
+produce exponentially many states, or run through a LazyDFA, which builds only
+the states that the input actually reaches and keeps a bounded number of their
+transitions, in the manner of RE2's DFA cache. from_regex() compiles a regular
+expression into an NFA with Thompson's construction.
+"""
+
+from collections import deque
+
+from DFA import DFA, DeltaCache, _timed
+
+class NFA:
+    def __init__(self, states, alphabet, delta, start, accepts, labels=None):
+        """The inputs are as for DFA, except that delta(q, c) returns an iterable of
+        states (possibly empty), and delta(q, None) gives the states q can move to
+        without consuming input (its epsilon-moves).
+        """
+        self.states = set(states)
+        self.alphabet = set(alphabet)
+        self.delta = delta
+        self.start = start
+        self.accepts = set(accepts)
+        self.labels = labels
+
+    def closure(self, states):
+        """Returns the frozenset of states reachable from the given ones by epsilon-moves."""
+        closure = set(states)
+        stack = list(closure)
+        while stack:
+            for next in self.delta(stack.pop(), None):
+                if next not in closure:
+                    closure.add(next)
+                    stack.append(next)
+        return frozenset(closure)
+
+    def step(self, subset, char):
+        """Returns the set of states, closed under epsilon-moves, that the states in
+        "subset" reach on "char". This is the transition function of the subset
+        construction.
+        """
+        next = set()
+        for q in subset:
+            next.update(self.delta(q, char))
+        return self.closure(next)
+
+    def recognizes(self, char_sequence):
+        """Indicates whether the NFA accepts a given string, by simulating it on
+        sets of states. Use lazy() to reuse the sets across calls.
+        """
+        subset = self.closure([self.start])
+        for char in char_sequence:
+            subset = self.step(subset, char)
+        return not subset.isdisjoint(self.accepts)
+
+    @_timed("determinize")
+    def determinize(self):
+        """Returns a DFA recognizing the same language, by the subset construction.
+        Its states are frozensets of NFA states, and only those reachable from the
+        start are built, the empty set serving as the sink. If the NFA has labels,
+        each accepting set is labeled with the labels of all its members.
+        """
+        start = self.closure([self.start])
+        transitions = {start: {}}
+        queue = deque([start])
+        while queue:
+            subset = queue.popleft()
+            for char in self.alphabet:
+                next = self.step(subset, char)
+                if next not in transitions:
+                    transitions[next] = {}
+                    queue.append(next)
+                transitions[subset][char] = next
+        accepts = [subset for subset in transitions if not subset.isdisjoint(self.accepts)]
+        labels = None
+        if self.labels is not None:
+            labels = {}
+            for subset in accepts:
+                labels[subset] = set()
+                for q in subset:
+                    labels[subset].update(self.labels.get(q, ()))
+        delta = lambda q, c: transitions[q][c]
+        return DFA(transitions.keys(), self.alphabet, delta, start, accepts, labels)
+
+    def lazy(self, cache_size=65536):
+        """Returns a LazyDFA for the NFA; see LazyDFA."""
+        return LazyDFA(self, cache_size)
+
+class LazyDFA:
+    """The subset-construction DFA of an NFA, built on demand while input is read.
+    Supports the execution methods of DFA. Every (state, symbol) transition is
+    computed the first time it is taken and then kept in an LRU DeltaCache of at
+    most "cache_size" entries, so inputs that stay on hot paths run at DFA speed
+    while memory stays bounded however many states the full DFA would have.
+    The cache is the "delta" attribute, with its hit and miss counts.
+    """
+    def __init__(self, nfa, cache_size=65536):
+        self.nfa = nfa
+        self.alphabet = nfa.alphabet
+        self.start = nfa.closure([nfa.start])
+        self.delta = DeltaCache(nfa.step, "lru", cache_size)
+        self.accepts = frozenset(nfa.accepts)
+        self.current_state = self.start
+
+    def input(self, char):
+        """Updates the current state based on a single character of input."""
+        self.current_state = self.delta(self.current_state, char)
+
+    def input_sequence(self, char_sequence):
+        """Updates the current state based on an iterable of inputs."""
+        delta, state = self.delta, self.current_state
+        for char in char_sequence:
+            state = delta(state, char)
+        self.current_state = state
+
+    def status(self):
+        """Indicates whether the current state is accepting."""
+        return not self.current_state.isdisjoint(self.accepts)
+
+    def reset(self):
+        """Returns to the starting state."""
+        self.current_state = self.start
+
+    def recognizes(self, char_sequence):
+        """Indicates whether the automaton accepts a given string."""
+        state_save = self.current_state
+        self.reset()
+        self.input_sequence(char_sequence)
+        valid = self.status()
+        self.current_state = state_save
+        return valid
+
+#
+# Regular expressions
+#
+
+class _Builder:
+    """Accumulates the states and transitions of a Thompson NFA. A fragment is a
+    pair (entry, exit) of states, with no transitions leaving the exit yet.
+    """
+    def __init__(self):
+        self.transitions = []
+
+    def state(self):
+        self.transitions.append({})
+        return len(self.transitions) - 1
+
+    def edge(self, q1, char, q2):
+        self.transitions[q1].setdefault(char, set()).add(q2)
+
+    def symbols(self, chars):
+        (entry, exit) = (self.state(), self.state())
+        for char in chars:
+            self.edge(entry, char, exit)
+        return (entry, exit)
+
+    def empty(self):
+        return self.symbols([None])
+
+    def concatenate(self, fragments):
+        if not fragments:
+            return self.empty()
+        for ((_, exit), (entry, _)) in zip(fragments, fragments[1:]):
+            self.edge(exit, None, entry)
+        return (fragments[0][0], fragments[-1][1])
+
+    def alternate(self, fragments):
+        (entry, exit) = (self.state(), self.state())
+        for (f_entry, f_exit) in fragments:
+            self.edge(entry, None, f_entry)
+            self.edge(f_exit, None, exit)
+        return (entry, exit)
+
+    def repeat(self, fragment, operator):
+        (entry, exit) = (self.state(), self.state())
+        (f_entry, f_exit) = fragment
+        self.edge(entry, None, f_entry)
+        self.edge(f_exit, None, exit)
+        if operator in '*?':
+            self.edge(entry, None, exit)
+        if operator in '*+':
+            self.edge(f_exit, None, f_entry)
+        return (entry, exit)
+
+class _Parser:
+    """A recursive-descent parser for the syntax described in from_regex(),
+    building the NFA as it goes.
+    """
+    def __init__(self, pattern, alphabet, builder):
+        self.pattern = pattern
+        self.pos = 0
+        self.alphabet = alphabet
+        self.builder = builder
+
+    def parse(self):
+        """Returns the fragment for the whole pattern."""
+        fragment = self.alternation()
+        if self.peek() is not None:
+            self.error("Unexpected %r" % (self.peek(),))
+        return fragment
+
+    def error(self, message):
+        raise ValueError("%s at position %d of regular expression %r" % (message, self.pos, self.pattern))
+
+    def peek(self):
+        if self.pos < len(self.pattern):
+            return self.pattern[self.pos]
+        return None
+
+    def next(self):
+        char = self.peek()
+        if char is None:
+            self.error("Unexpected end")
+        self.pos += 1
+        return char
+
+    def literal(self, char):
+        if char not in self.alphabet:
+            self.error("Symbol %r not in the alphabet" % (char,))
+        return char
+
+    def alternation(self):
+        branches = [self.concatenation()]
+        while self.peek() == '|':
+            self.pos += 1
+            branches.append(self.concatenation())
+        if len(branches) == 1:
+            return branches[0]
+        return self.builder.alternate(branches)
+
+    def concatenation(self):
+        fragments = []
+        while self.peek() is not None and self.peek() not in '|)':
+            fragments.append(self.repetition())
+        return self.builder.concatenate(fragments)
+
+    def repetition(self):
+        fragment = self.atom()
+        while self.peek() is not None and self.peek() in '*+?':
+            fragment = self.builder.repeat(fragment, self.next())
+        return fragment
+
+    def atom(self):
+        char = self.next()
+        if char == '(':
+            fragment = self.alternation()
+            if self.peek() != ')':
+                self.error("Missing )")
+            self.pos += 1
+            return fragment
+        if char == '[':
+            return self.builder.symbols(self.char_class())
+        if char == '.':
+            return self.builder.symbols(self.alphabet)
+        if char == '\\':
+            return self.builder.symbols([self.literal(self.next())])
+        if char in '*+?|)]':
+            self.pos -= 1
+            self.error("Unexpected %r" % (char,))
+        return self.builder.symbols([self.literal(char)])
+
+    def char_class(self):
+        negated = self.peek() == '^'
+        if negated:
+            self.pos += 1
+        chars = set()
+        first = True
+        while first or self.peek() != ']':
+            first = False
+            low = self.next()
+            if low == '\\':
+                low = self.next()
+            if self.peek() == '-' and self.pattern[self.pos+1:self.pos+2] not in ('', ']'):
+                self.pos += 1
+                high = self.next()
+                if high == '\\':
+                    high = self.next()
+                chars.update([c for c in self.alphabet if low <= c <= high])
+            else:
+                chars.add(self.literal(low))
+        self.pos += 1
+        if negated:
+            return self.alphabet - chars
+        return chars
+
+@_timed("from_regex")
+def from_regex(pattern, alphabet):
+    """Compiles a regular expression into an NFA over the given alphabet, of
+    single-character symbols. The NFA must match the whole input. Supported syntax:
+     - a literal symbol, or any character escaped with a backslash;
+     - "." for any symbol of the alphabet;
+     - character classes such as "[abc]", "[a-z]" and "[^0-9]";
+     - grouping with parentheses, alternation with "|", and the postfix
+       operators "*", "+" and "?".
+    Call determinize() on the result to get a DFA, or lazy() to match without
+    building the whole DFA.
+    """
+    builder = _Builder()
+    (entry, exit) = _Parser(pattern, set(alphabet), builder).parse()
+    transitions = builder.transitions
+    delta = lambda q, c: transitions[q].get(c, ())
+    return NFA(range(len(transitions)), alphabet, delta, entry, [exit])
+
+@_timed("from_regexes")
+def from_regexes(patterns, alphabet):
+    """Compiles several regular expressions, in the syntax of from_regex(), into one
+    NFA accepting the union of their languages, whose accepting states are labeled
+    with the patterns they complete. "patterns" is a dict mapping labels to patterns,
+    or a list of patterns labeled by their positions. Prefix every pattern with ".*"
+    and call matches() on the determinized DFA to find all the occurrences of all the
+    patterns in one pass.
+    """
+    if isinstance(patterns, dict):
+        patterns = patterns.items()
+    else:
+        patterns = list(enumerate(patterns))
+    alphabet = set(alphabet)
+    builder = _Builder()
+    fragments = []
+    labels = {}
+    for (label, pattern) in patterns:
+        (entry, exit) = _Parser(pattern, alphabet, builder).parse()
+        fragments.append((entry, exit))
+        labels[exit] = [label]
+    start = builder.state()
+    for (entry, exit) in fragments:
+        builder.edge(start, None, entry)
+    transitions = builder.transitions
+    delta = lambda q, c: transitions[q].get(c, ())
+    return NFA(range(len(transitions)), alphabet, delta, start, labels.keys(), labels)
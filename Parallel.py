@@ -0,0 +1,456 @@
+"""Multi-process versions of the heaviest DFA operations, for automata with millions
+of states. The transition tables of the compiled automata are copied once into
+shared memory (multiprocessing.sharedctypes; multiprocessing.shared_memory does not
+exist on Python 2), and worker processes forked after that read them without
+copying.
+
+Every worker owns a hash-partition of the states and keeps its own part of the
+bookkeeping: the states it has reached, the ids of the product states it has
+built, the predecessors of its states. Workers send each other only the states
+that the receiver owns, through one inbox queue per worker, after removing the
+duplicates and the states already known to be reached; the parent process only
+starts the rounds and adds up their counts.
+
+Minimization uses Moore-style partition refinement, but only the predecessors of
+the states that moved in the previous round are re-examined, and the largest piece
+of every split keeps its block number, so every state moves O(logn) times and the
+total work is O(k^2*n*logn) however deep the automaton is. The workers compute the
+signatures of the states they own; rounds that move fewer than SERIAL_BELOW states
+run in the parent, so deep automata do not pay one round trip per level.
+
+The results are the same as those of the single-process operations, but with
+state numbering that may differ. Workers are forked, so this module needs a
+platform with fork(). For small automata the process start-up and the messages
+cost more than they save; benchmarks/parallel.py reports the measured speedup.
+"""
+
+import traceback
+from array import array
+from multiprocessing import Process, Pipe, Queue, cpu_count
+from multiprocessing.sharedctypes import RawArray
+
+from DFA import CompactDFA, _Phase, _record_round, _record_product, _product_labels, \
+    _product_symbol_ids
+
+#Refinement rounds moving fewer states than this run in the parent process
+SERIAL_BELOW = 2000
+
+#
+# Worker side. The parent fills _context before forking the workers, which
+# inherit it; every task receives the worker's own state dict.
+#
+
+_context = {}
+
+def _pack(ints):
+    return array('l', ints).tostring()
+
+def _unpack(data):
+    ints = array('l')
+    ints.fromstring(data)
+    return ints
+
+def _owner(code, processes):
+    """The worker owning a state or a product state code."""
+    return (code*2654435761 >> 7) % processes
+
+def _worker(w, processes, connection, inboxes):
+    state = {'w': w, 'processes': processes, 'inboxes': inboxes, 'stash': {}}
+    state.update(_context)
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        (name, args) = message
+        try:
+            connection.send((True, _TASKS[name](state, *args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+
+def _send(state, v, tag, data):
+    """Puts a message of the exchange "tag" in the inbox of worker v."""
+    state['inboxes'][v].put((tag, state['w'], data))
+
+def _receive(state, tag):
+    """Returns the messages of the exchange "tag", one from every worker, in
+    order of sender. Messages of other exchanges are kept for later.
+    """
+    stash = state['stash']
+    messages = stash.pop(tag, {})
+    inbox = state['inboxes'][state['w']]
+    while len(messages) < state['processes']:
+        (t, sender, data) = inbox.get()
+        if t == tag:
+            messages[sender] = data
+        else:
+            stash.setdefault(t, {})[sender] = data
+    return [messages[v] for v in range(state['processes'])]
+
+def _bfs_round(state, r, seed):
+    """Marks the states received in round r that were not reached yet, and sends
+    their successors to their owners for round r+1. Returns the number of states
+    marked.
+    """
+    (P, table, k, reached) = (state['processes'], state['table'], state['k'], state['reached'])
+    if r == 0:
+        inbox = [seed]
+    else:
+        inbox = _receive(state, ('bfs', r))
+    new = []
+    for data in inbox:
+        for i in _unpack(data):
+            if not reached[i]:
+                reached[i] = 1
+                new.append(i)
+    buckets = [set() for v in range(P)]
+    for i in new:
+        for next in table[i*k:i*k+k]:
+            if not reached[next]:
+                buckets[_owner(next, P)].add(next)
+    for v in range(P):
+        _send(state, v, ('bfs', r+1), _pack(buckets[v]))
+    return len(new)
+
+def _bfs_finish(state, r):
+    """Drops the (empty) messages of the round after the last one."""
+    _receive(state, ('bfs', r))
+
+def _predecessors(table, k, states):
+    """Returns a dict mapping every state to the list of its predecessors among
+    "states" (with repetitions).
+    """
+    preds = {}
+    for i in states:
+        for next in table[i*k:i*k+k]:
+            preds.setdefault(next, []).append(i)
+    return preds
+
+def _touched_groups(table, k, block_of, preds, moved):
+    """Returns a dict mapping the signature (block, blocks of the successors) of
+    every predecessor of a moved state to the list of those predecessors.
+    """
+    groups = {}
+    seen = set()
+    for i in moved:
+        for p in preds.get(i, ()):
+            if p not in seen:
+                seen.add(p)
+                signature = (block_of[p],) + tuple([block_of[next] for next in table[p*k:p*k+k]])
+                groups.setdefault(signature, []).append(p)
+    return groups
+
+def _refine_setup(state):
+    """Indexes the predecessors among the reached states the worker owns."""
+    (w, P, n) = (state['w'], state['processes'], len(state['reached']))
+    reached = state['reached']
+    owned = [i for i in xrange(n) if reached[i] and _owner(i, P) == w]
+    state['preds'] = _predecessors(state['table'], state['k'], owned)
+
+def _refine_round(state, count):
+    """_touched_groups() for the worker's own states and the first "count" states
+    of the shared "moved" array, with the groups packed.
+    """
+    groups = _touched_groups(state['table'], state['k'], state['block_of'], state['preds'],
+                             state['moved'][:count])
+    return dict([(signature, _pack(members)) for (signature, members) in groups.iteritems()])
+
+def _product_round(state, r, seed):
+    """Like _bfs_round(), for product states coded as i1*n2+i2. The worker numbers
+    the new states it owns, and keeps their rows of successor codes.
+    """
+    (P, k, n2) = (state['processes'], state['k'], state['n2'])
+    (table1, table2, symbol_map) = (state['table'], state['table2'], state['symbol_map'])
+    (ids, codes, rows) = (state['ids'], state['codes'], state['rows'])
+    if r == 0:
+        inbox = [seed]
+    else:
+        inbox = _receive(state, ('product', r))
+    new = []
+    for data in inbox:
+        for code in _unpack(data):
+            if code not in ids:
+                ids[code] = len(codes)
+                codes.append(code)
+                new.append(code)
+    buckets = [set() for v in range(P)]
+    for code in new:
+        (i1, i2) = divmod(code, n2)
+        for j in range(k):
+            next = table1[i1*k+j]*n2 + table2[i2*k+symbol_map[j]]
+            rows.append(next)
+            if next not in ids:
+                buckets[_owner(next, P)].add(next)
+    for v in range(P):
+        _send(state, v, ('product', r+1), _pack(buckets[v]))
+    return len(new)
+
+def _product_count(state, r):
+    """Drops the messages of the round after the last one, and returns the number
+    of product states the worker owns.
+    """
+    _receive(state, ('product', r))
+    return len(state['codes'])
+
+def _product_finish(state, offsets):
+    """Asks the other workers for the numbers of the successors they own, given
+    that worker v numbers its states from offsets[v], and returns the worker's
+    rows of the transition table, acceptance-values and state codes, packed.
+    """
+    (w, P, n2) = (state['w'], state['processes'], state['n2'])
+    (ids, codes, rows) = (state['ids'], state['codes'], state['rows'])
+    (accepting1, accepting2, accept_method) = (state['accepting'], state['accepting2'], state['accept_method'])
+    needed = [set() for v in range(P)]
+    for next in rows:
+        needed[_owner(next, P)].add(next)
+    needed = [sorted(codes_v) for codes_v in needed]
+    for v in range(P):
+        _send(state, v, 'need', _pack(needed[v]))
+    for (v, data) in enumerate(_receive(state, 'need')):
+        _send(state, v, 'ids', _pack([offsets[w] + ids[code] for code in _unpack(data)]))
+    numbers = {}
+    for (v, data) in enumerate(_receive(state, 'ids')):
+        numbers.update(zip(needed[v], _unpack(data)))
+    table = array('i', [numbers[next] for next in rows])
+    accepting = bytearray([int(bool(accept_method(bool(accepting1[code//n2]), bool(accepting2[code%n2]))))
+                           for code in codes])
+    return (table.tostring(), str(accepting), _pack(codes))
+
+_TASKS = {
+    "bfs_round": _bfs_round,
+    "bfs_finish": _bfs_finish,
+    "refine_setup": _refine_setup,
+    "refine_round": _refine_round,
+    "product_round": _product_round,
+    "product_count": _product_count,
+    "product_finish": _product_finish,
+}
+
+#
+# Parent side
+#
+
+class _Workers:
+    """A set of forked worker processes, each with a pipe to the parent and an
+    inbox queue for the messages of the other workers. "context" is copied into
+    every worker's state dict; arrays in it are shared only if they are RawArrays.
+    """
+    def __init__(self, context, processes=None):
+        self.processes = processes or cpu_count()
+        inboxes = [Queue() for v in range(self.processes)]
+        self.connections = []
+        self.workers = []
+        _context.update(context)
+        try:
+            for w in range(self.processes):
+                (connection, worker_connection) = Pipe()
+                worker = Process(target=_worker, args=(w, self.processes, worker_connection, inboxes))
+                worker.daemon = True
+                worker.start()
+                self.connections.append(connection)
+                self.workers.append(worker)
+        finally:
+            _context.clear()
+
+    def call(self, name, *args):
+        """Runs the task "name" on every worker with the same arguments, and
+        returns the list of results.
+        """
+        return self.call_each(name, [args]*self.processes)
+
+    def call_each(self, name, args):
+        """Runs the task "name" on every worker w with the arguments args[w]."""
+        for (connection, a) in zip(self.connections, args):
+            connection.send((name, a))
+        results = []
+        for connection in self.connections:
+            (ok, result) = connection.recv()
+            if not ok:
+                raise RuntimeError("Parallel task %s failed:\n%s" % (name, result))
+            results.append(result)
+        return results
+
+    def close(self):
+        for worker in self.workers:
+            worker.terminate()
+            worker.join()
+
+def _shared_automaton(C):
+    """The context describing the CompactDFA C to the workers."""
+    return {
+        'table': RawArray('i', C.table),
+        'k': len(C.alphabet),
+        'accepting': RawArray('b', C.accepting),
+        'reached': RawArray('b', len(C.states)),
+    }
+
+def _reachable_from(workers, C, i0):
+    """Level-synchronous BFS over the workers. Fills the shared "reached" array."""
+    P = workers.processes
+    seeds = [_pack([])]*P
+    seeds[_owner(i0, P)] = _pack([i0])
+    r = 0
+    while sum(workers.call_each("bfs_round", [(r, seed) for seed in seeds])):
+        r += 1
+        seeds = [None]*P
+    workers.call("bfs_finish", r+1)
+
+def _refine(workers, C, states, block_of, moved_array):
+    """Partition refinement of "states", which must be closed under delta, into
+    Myhill-Nerode classes. Block b is elements[start[b]:end[b]].
+    """
+    n, k, table = len(C.states), len(C.alphabet), C.table
+    #Step 1: Start from the partition by acceptance and labels
+    groups = {}
+    for i in states:
+        if C.labels is None:
+            key = C.accepting[i]
+        else:
+            key = (C.accepting[i], C.labels[i])
+        groups.setdefault(key, []).append(i)
+    elements = array('i')
+    where = array('i', [0])*n
+    start, end = [], []
+    for members in groups.values():
+        start.append(len(elements))
+        for i in members:
+            block_of[i] = len(end)
+            where[i] = len(elements)
+            elements.append(i)
+        end.append(len(elements))
+    workers.call("refine_setup")
+    preds = None
+    #Step 2: Refine. Touched states never share a signature with the untouched
+    # states of their block, whose successors did not move, so those stay put.
+    moved = states
+    while len(moved):
+        if len(moved) < SERIAL_BELOW:
+            if preds is None:
+                preds = _predecessors(table, k, states)
+            touched = _touched_groups(table, k, block_of, preds, moved)
+        else:
+            moved_array[:len(moved)] = moved
+            touched = {}
+            for part in workers.call("refine_round", len(moved)):
+                for (signature, data) in part.iteritems():
+                    touched.setdefault(signature, array('l')).fromstring(data)
+        by_block = {}
+        for (signature, members) in touched.iteritems():
+            by_block.setdefault(signature[0], []).append(members)
+        moved = []
+        for (b, pieces) in by_block.iteritems():
+            count = sum(map(len, pieces))
+            if len(pieces) + (count < end[b] - start[b]) < 2:
+                continue
+            #Lay the touched pieces out at the front of b's range
+            pos = start[b]
+            spans = []
+            for members in pieces:
+                lo = pos
+                for i in members:
+                    other = elements[pos]
+                    (elements[pos], elements[where[i]]) = (i, other)
+                    (where[other], where[i]) = (where[i], pos)
+                    pos += 1
+                spans.append((lo, pos))
+            if pos < end[b]:
+                spans.append((pos, end[b]))
+            largest = max(spans, key=lambda (lo, hi): hi - lo)
+            for (lo, hi) in spans:
+                if (lo, hi) == largest:
+                    (start[b], end[b]) = (lo, hi)
+                    continue
+                group = elements[lo:hi]
+                for i in group:
+                    block_of[i] = len(end)
+                start.append(lo)
+                end.append(hi)
+                moved.extend(group)
+        _record_round("parallel.refine", len(end))
+    return [elements[start[b]:end[b]] for b in range(len(end))]
+
+def reachable_from(C, i0, processes=None):
+    """Returns the sorted list of states of the CompactDFA C reachable from state i0,
+    as CompactDFA.reachable_from() does.
+    """
+    context = _shared_automaton(C)
+    workers = _Workers(context, processes)
+    try:
+        _reachable_from(workers, C, i0)
+    finally:
+        workers.close()
+    reached = context['reached']
+    return [i for i in range(len(C.states)) if reached[i]]
+
+def minimize(D, processes=None):
+    """Minimizes the DFA D in place, like D.minimize(), but with the reachability
+    search and the partition refinement spread over "processes" processes (by
+    default one per CPU).
+    """
+    with _Phase("parallel.minimize"):
+        C = D.compile()
+        n = len(C.states)
+        context = _shared_automaton(C)
+        context['block_of'] = RawArray('i', n)
+        context['moved'] = RawArray('i', n)
+        workers = _Workers(context, processes)
+        try:
+            _reachable_from(workers, C, C.start)
+            reached = [i for i in range(n) if context['reached'][i]]
+            classes = _refine(workers, C, reached, context['block_of'], context['moved'])
+        finally:
+            workers.close()
+        D.states = [C.states[i] for i in reached]
+        D.accepts = [C.states[i] for i in reached if C.accepting[i]]
+        D.collapse([[C.states[i] for i in block] for block in classes])
+
+def cross_product(D1, D2, accept_method, processes=None):
+    """Builds the part of the cross product of D1 and D2 that is reachable from the
+    pair of start states, as DFA.cross_product(D1, D2, accept_method, lazy=True)
+    does, but with the product states hash-partitioned over the workers. Returns a
+    CompactDFA whose states are named by pairs of original state names.
+    """
+    assert(D1.alphabet == D2.alphabet)
+    with _Phase("parallel.cross_product"):
+        C1, C2 = D1.compile(), D2.compile()
+        symbol_ids = _product_symbol_ids([C1, C2])
+        n2 = len(C2.states)
+        context = _shared_automaton(C1)
+        context.update({
+            'table2': RawArray('i', C2.table),
+            'accepting2': RawArray('b', C2.accepting),
+            'symbol_map': [C2.symbol_ids[c] for c in C1.alphabet],
+            'n2': n2,
+            'accept_method': accept_method,
+            'ids': {},
+            'codes': [],
+            'rows': array('l'),
+        })
+        workers = _Workers(context, processes)
+        try:
+            P = workers.processes
+            start = C1.start*n2 + C2.start
+            seeds = [_pack([])]*P
+            seeds[_owner(start, P)] = _pack([start])
+            r = 0
+            while sum(workers.call_each("product_round", [(r, seed) for seed in seeds])):
+                r += 1
+                seeds = [None]*P
+            counts = workers.call("product_count", r+1)
+            offsets = [sum(counts[:w]) for w in range(P)]
+            parts = workers.call("product_finish", offsets)
+        finally:
+            workers.close()
+        table = array('i')
+        accepting = bytearray()
+        codes = array('l')
+        for (rows, part_accepting, part_codes) in parts:
+            table.fromstring(rows)
+            accepting.extend(part_accepting)
+            codes.fromstring(part_codes)
+        pairs = [divmod(code, n2) for code in codes]
+        _record_product("parallel.cross_product", len(pairs))
+        states = [(C1.states[i1], C2.states[i2]) for (i1, i2) in pairs]
+        C = CompactDFA(states, list(C1.alphabet), table, offsets[_owner(start, P)], accepting)
+        C.symbol_ids = symbol_ids
+        C.labels = _product_labels([C1, C2], pairs, accepting)
+        return C
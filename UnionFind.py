@@ -1,27 +1,57 @@
-"""Implements a Union-Find (or discrete-set) data-structure with the following performance profile:
+"""Implements a Union-Find (or disjoint-set) data-structure as a forest with union
+by rank and path compression, with the following performance profile:
 -makeset O(1)
--find O(1)
--union O(n)
+-find O(a(n)) amortized
+-union O(a(n)) amortized
+where a is the inverse Ackermann function, which is at most 4 for any practical n.
 """
 
+from array import array
+
 class UnionFind():
-    def __init__(self):
-        self.sets = []
-        self.lookup = {}
+    def __init__(self, size=None):
+        """If "size" is given, the elements are the integers 0..size-1, each one
+        starting out in a set of its own, and the forest is kept in integer arrays.
+        Otherwise elements can be any hashable values, added with make_set().
+        """
+        if size is None:
+            self.parent = {}
+            self.rank = {}
+        else:
+            self.parent = array('i', range(size))
+            self.rank = array('i', [0])*size
     def make_set(self, item):
-        new_set = [item]
-        self.sets.append(new_set)
-        self.lookup[item] = new_set
+        self.parent[item] = item
+        self.rank[item] = 0
     def find(self, item):
-        return self.lookup[item]
+        """Returns the representative of the set containing item."""
+        parent = self.parent
+        root = item
+        while parent[root] != root:
+            root = parent[root]
+        while parent[item] != root:
+            parent[item], item = root, parent[item]
+        return root
     def union(self, set1, set2):
-        """Merges set1 into set2"""
-        assert(set1 in self.sets)
-        assert(set2 in self.sets)
-        for (item, value) in self.lookup.iteritems():
-            if value == set1:
-                self.lookup[item] = set2
-        self.sets.remove(set1)
-        set2.extend(set1)
+        """Merges the sets containing set1 and set2, which may be any of their
+        members. Returns the representative of the merged set.
+        """
+        root1, root2 = self.find(set1), self.find(set2)
+        if root1 == root2:
+            return root1
+        rank = self.rank
+        if rank[root1] > rank[root2]:
+            root1, root2 = root2, root1
+        self.parent[root1] = root2
+        if rank[root1] == rank[root2]:
+            rank[root2] += 1
+        return root2
     def as_lists(self):
-        return self.sets
+        if isinstance(self.parent, dict):
+            items = self.parent.keys()
+        else:
+            items = range(len(self.parent))
+        groups = {}
+        for item in items:
+            groups.setdefault(self.find(item), []).append(item)
+        return groups.values()
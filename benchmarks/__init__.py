@@ -0,0 +1,8 @@
+"""Benchmarks for python-automata. Run the modules from the repository root:
+
+    python -m benchmarks.suite run results.json
+    python -m benchmarks.suite compare old.json new.json
+    python -m benchmarks.dfca [number_of_words ...]
+    python -m benchmarks.hyper_minimize [trials [max_states]]
+    python -m benchmarks.parallel [states [processes]]
+"""
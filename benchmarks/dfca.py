@@ -0,0 +1,57 @@
+"""Compares the two DFCA minimization algorithms on random dictionaries built with
+DFA.minimal_from_word_list(). Usage:
+
+    python -m benchmarks.dfca [number_of_words ...]
+
+By default, both algorithms run on the COMPARED sizes, small enough for the O(n^2)
+"gap" algorithm, and the ratio of their times shows where they part ways; then
+"korner" alone runs on the LARGE sizes. The "gap" algorithm is skipped once the
+minimized DFA has more than GAP_LIMIT states, since it would not finish in
+reasonable time. Runs on fewer than REPEAT_BELOW states report the best of
+REPEATS timings.
+"""
+
+import sys
+import time
+
+import DFA
+from benchmarks.workloads import ALPHABET, random_words
+
+COMPARED = [1, 3, 10, 30, 100, 300]
+LARGE = [10**4, 10**5, 10**6]
+GAP_LIMIT = 1000
+REPEAT_BELOW = 1000
+REPEATS = 3
+
+def timed(D, algorithm):
+    """Returns the best time of DFCA-minimizing copies of D, and the number of
+    states of the result.
+    """
+    best = None
+    for trial in range(len(D.states) < REPEAT_BELOW and REPEATS or 1):
+        D2 = D.copy()
+        t = time.time()
+        D2.DFCA_minimize(algorithm=algorithm)
+        t = time.time() - t
+        if best is None or t < best:
+            best = t
+    return (best, len(D2.states))
+
+def run(count):
+    D = DFA.minimal_from_word_list(random_words(count), ALPHABET)
+    print "%d words, %d states" % (count, len(D.states))
+    times = {}
+    for algorithm in ["korner", "gap"]:
+        if algorithm == "gap" and len(D.states) > GAP_LIMIT:
+            print "  %-8s skipped" % algorithm
+            continue
+        (t, states) = timed(D, algorithm)
+        times[algorithm] = t
+        print "  %-8s %8.3fs  %d states" % (algorithm, t, states)
+    if len(times) == 2 and times["korner"]:
+        print "  gap/korner %6.2fx" % (times["gap"]/times["korner"])
+
+if __name__ == "__main__":
+    counts = map(int, sys.argv[1:]) or COMPARED + LARGE
+    for count in counts:
+        run(count)
@@ -0,0 +1,44 @@
+"""Cross-checks and times the two hyper-minimization engines on DFAs built with
+DFA.random(). For every DFA, both results must have the same number of states,
+and each must be finitely different from the other and from the original.
+Usage:
+
+    python -m benchmarks.hyper_minimize [trials [max_states]]
+"""
+
+import sys
+import time
+import random
+
+import DFA
+
+ALGORITHMS = ["f_equivalence", "holzer_maletti"]
+
+def check(seed, max_states):
+    random.seed(seed)
+    D = DFA.random(random.randint(1, max_states), random.randint(1, 3), random.random())
+    D.minimize()
+    results = {}
+    times = {}
+    for algorithm in ALGORITHMS:
+        D2 = D.copy()
+        t = time.time()
+        D2.hyper_minimize(algorithm=algorithm)
+        times[algorithm] = time.time() - t
+        assert DFA.symmetric_difference(D, D2, lazy=True).is_finite(), (seed, algorithm)
+        results[algorithm] = D2
+    sizes = [len(results[a].states) for a in ALGORITHMS]
+    assert len(set(sizes)) == 1, (seed, sizes)
+    assert DFA.symmetric_difference(results[ALGORITHMS[0]], results[ALGORITHMS[1]], lazy=True).is_finite(), seed
+    return times
+
+if __name__ == "__main__":
+    trials = len(sys.argv) > 1 and int(sys.argv[1]) or 200
+    max_states = len(sys.argv) > 2 and int(sys.argv[2]) or 30
+    totals = dict([(a, 0.0) for a in ALGORITHMS])
+    for seed in range(trials):
+        for (algorithm, t) in check(seed, max_states).iteritems():
+            totals[algorithm] += t
+    print "%d random DFAs with up to %d states: engines agree" % (trials, max_states)
+    for algorithm in ALGORITHMS:
+        print "  %-15s %8.3fs" % (algorithm, totals[algorithm])
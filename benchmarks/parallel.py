@@ -0,0 +1,41 @@
+"""Reports the speedup of the multi-process operations in Parallel.py over their
+single-process counterparts, on a random DFA and on a chain of states/100 states
+(one refinement round per state). A ratio below 1 means the parallel path was
+slower. Usage:
+
+    python -m benchmarks.parallel [states [processes]]
+"""
+
+import sys
+import time
+
+import DFA
+import Parallel
+from benchmarks.workloads import random_dfa
+
+def timed(function):
+    start = time.time()
+    result = function()
+    return (time.time() - start, result)
+
+def run(states, processes):
+    D = random_dfa(states, seed=0)
+    E = random_dfa(10, seed=1)
+    chain = DFA.minimal_from_word_list(['a'*(states//100)], 'ab')
+    print "%d states, %d processes, %d CPUs" % (states, processes, Parallel.cpu_count())
+    cases = [
+        ("minimize", lambda: D.copy().minimize(), lambda: Parallel.minimize(D.copy(), processes)),
+        ("minimize_chain", lambda: chain.copy().minimize(),
+                           lambda: Parallel.minimize(chain.copy(), processes)),
+        ("cross_product", lambda: DFA.intersection(D, E, lazy=True),
+                          lambda: Parallel.cross_product(D, E, bool.__and__, processes)),
+    ]
+    for (name, single, parallel) in cases:
+        (t1, r1) = timed(single)
+        (t2, r2) = timed(parallel)
+        print "  %-14s %8.3fs single %8.3fs parallel  %5.2fx speedup" % (name, t1, t2, t1/t2)
+
+if __name__ == "__main__":
+    states = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    processes = len(sys.argv) > 2 and int(sys.argv[2]) or Parallel.cpu_count()
+    run(states, processes)
@@ -0,0 +1,271 @@
+"""Times the main DFA operations on workloads of geometrically growing size, and
+compares two recorded runs. Usage:
+
+    python -m benchmarks.suite run results.json [--max-size N] [--seed S]
+    python -m benchmarks.suite compare old.json new.json [--threshold 1.25]
+
+Every record holds the wall time, the peak memory and the number of transitions
+processed per second. Each measurement runs in a forked child process, and its
+peak memory is the growth of the child's maximum resident set size over its size
+at the fork, as reported by os.wait4(). Where fork() is not available, the peak
+is measured with tracemalloc if it exists (Python 3.4+), and is None otherwise.
+The compare command exits with status 1 if any operation got slower than the
+threshold ratio, or used more memory than that ratio and more than MEMORY_FLOOR
+bytes.
+"""
+
+import os
+import sys
+import time
+import json
+import platform
+import argparse
+import traceback
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import DFA
+from benchmarks.workloads import WORKLOADS, geometric_sizes, random_strings, random_words, ALPHABET
+
+def transitions(D):
+    """The number of (state, symbol) pairs of a DFA."""
+    return len(D.states)*len(D.alphabet)
+
+#
+# Operations. Each one takes a workload's size, seed and DFA, and returns a
+# pair (function, work): calling function() runs the operation once, and work
+# is the number of transitions it processes.
+#
+
+def op_minimize(size, seed, D):
+    return (D.minimize, transitions(D))
+
+def op_hyper_minimize(size, seed, D):
+    return (D.hyper_minimize, transitions(D))
+
+def op_hyper_minimize_hm(size, seed, D):
+    return (lambda: D.hyper_minimize(algorithm="holzer_maletti"), transitions(D))
+
+def op_DFCA_minimize(size, seed, D):
+    return (lambda: D.DFCA_minimize(algorithm="korner"), transitions(D))
+
+def op_cross_product(size, seed, D):
+    return (lambda: DFA.intersection(D, D), transitions(D)*len(D.states))
+
+def op_cross_product_lazy(size, seed, D):
+    return (lambda: DFA.intersection(D, D, lazy=True), transitions(D))
+
+def op_is_finite(size, seed, D):
+    return (D.is_finite, transitions(D))
+
+def op_recognizes(size, seed, D):
+    strings = random_strings(100, 100, D.alphabet, seed)
+    return (lambda: [D.recognizes(s) for s in strings], 100*100)
+
+def op_recognize_many(size, seed, D):
+    strings = random_strings(100, 100, D.alphabet, seed)
+    return (lambda: D.recognize_many(strings), 100*100)
+
+def op_from_word_list(size, seed, D):
+    words = random_words(size, seed)
+    return (lambda: DFA.from_word_list(words, ALPHABET), sum(map(len, words)))
+
+def op_minimal_from_word_list(size, seed, D):
+    words = random_words(size, seed)
+    return (lambda: DFA.minimal_from_word_list(words, ALPHABET), sum(map(len, words)))
+
+def op_add_word(size, seed, D):
+    words = random_words(101, seed + 1)
+    D.add_word(words[0]) #the first edit minimizes the DFA
+    return (lambda: [D.add_word(w) for w in words[1:]], sum(map(len, words[1:])))
+
+#(name, operation, workloads, largest size relative to --max-size)
+OPERATIONS = [
+    ("minimize", op_minimize, ["random", "modular_zero", "word_list"], 1),
+    ("hyper_minimize", op_hyper_minimize, ["random", "modular_zero"], 0.1),
+    ("hyper_minimize_hm", op_hyper_minimize_hm, ["random", "modular_zero"], 1),
+    ("DFCA_minimize", op_DFCA_minimize, ["word_list"], 0.1),
+    ("cross_product", op_cross_product, ["random", "modular_zero"], 0.03),
+    ("cross_product_lazy", op_cross_product_lazy, ["random", "modular_zero"], 1),
+    ("is_finite", op_is_finite, ["random", "word_list"], 1),
+    ("recognizes", op_recognizes, ["random", "modular_zero"], 1),
+    ("recognize_many", op_recognize_many, ["random", "modular_zero"], 1),
+    ("from_word_list", op_from_word_list, ["word_list"], 1),
+    ("minimal_from_word_list", op_minimal_from_word_list, ["word_list"], 1),
+    ("add_word", op_add_word, ["word_list"], 1),
+]
+
+#Memory growth below this many bytes is too close to the page granularity of
+# the resident set size to count as a regression.
+MEMORY_FLOOR = 1 << 20
+
+def maxrss_bytes(ru_maxrss):
+    """Converts a ru_maxrss value, in kilobytes except on Mac OS X, to bytes."""
+    if sys.platform == "darwin":
+        return ru_maxrss
+    return ru_maxrss*1024
+
+def measure(function):
+    """Runs function() once. Returns the wall time and the peak memory in bytes."""
+    if hasattr(os, "fork") and resource is not None:
+        return measure_forked(function)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (seconds, peak)
+
+def measure_forked(function):
+    """Runs function() once in a child process, so that its peak resident set size
+    is its own. The child sends back the wall time and its resident set size at the
+    fork; the parent reads the child's peak from os.wait4().
+    """
+    (read_end, write_end) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        status = 0
+        try:
+            try:
+                baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                start = time.time()
+                function()
+                seconds = time.time() - start
+                message = json.dumps([seconds, baseline])
+            except BaseException:
+                message = json.dumps(traceback.format_exc())
+                status = 1
+            os.write(write_end, message.encode("utf-8"))
+            os.close(write_end)
+        finally:
+            os._exit(status)
+    os.close(write_end)
+    chunks = []
+    while True:
+        chunk = os.read(read_end, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_end)
+    (pid, status, usage) = os.wait4(pid, 0)
+    message = json.loads(b"".join(chunks).decode("utf-8"))
+    if status != 0:
+        raise RuntimeError("benchmark failed in the child process:\n%s" % message)
+    (seconds, baseline) = message
+    return (seconds, maxrss_bytes(usage.ru_maxrss - baseline))
+
+def run(max_size, seed=0, smallest=10, log=None):
+    """Runs every operation on every workload size up to its limit, and returns
+    the list of records.
+    """
+    records = []
+    for (name, operation, workloads, scale) in OPERATIONS:
+        for workload in workloads:
+            for size in geometric_sizes(smallest, max(smallest, int(max_size*scale))):
+                D = WORKLOADS[workload](size, seed)
+                (function, work) = operation(size, seed, D)
+                (seconds, peak) = measure(function)
+                record = {
+                    "operation": name,
+                    "workload": workload,
+                    "size": size,
+                    "seconds": seconds,
+                    "peak_bytes": peak,
+                    "transitions_per_second": seconds and work/seconds or None,
+                }
+                records.append(record)
+                if log is not None:
+                    log.write("%-22s %-13s %8d %10.4fs\n" % (name, workload, size, seconds))
+    return records
+
+def ratio(before, after):
+    """Returns after/before, or None if either is missing or before is 0."""
+    if not before or after is None:
+        return None
+    return float(after)/before
+
+def compare(old, new, threshold):
+    """Returns a list of (key, old record, new record, time ratio, memory ratio) for
+    the records present in both runs, and a dict mapping the keys that regressed to
+    the list of what got worse than threshold: "time", "memory" or both.
+    """
+    def key(record):
+        return (record["operation"], record["workload"], record["size"])
+    old_records = dict([(key(r), r) for r in old["results"]])
+    rows = []
+    regressions = {}
+    for record in new["results"]:
+        k = key(record)
+        if k not in old_records:
+            continue
+        before = old_records[k]
+        time_ratio = ratio(before["seconds"], record["seconds"])
+        memory_ratio = ratio(before.get("peak_bytes"), record.get("peak_bytes"))
+        rows.append((k, before, record, time_ratio, memory_ratio))
+        if time_ratio is not None and time_ratio > threshold:
+            regressions.setdefault(k, []).append("time")
+        if memory_ratio is not None and memory_ratio > threshold and record["peak_bytes"] > MEMORY_FLOOR:
+            regressions.setdefault(k, []).append("memory")
+    return (rows, regressions)
+
+def format_ratio(r):
+    return r is not None and "%.2fx" % r or "-"
+
+def format_bytes(n):
+    return n is not None and "%.1fM" % (n/float(1 << 20)) or "-"
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="DFA operation benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run the benchmarks and write a JSON file")
+    run_parser.add_argument("output")
+    run_parser.add_argument("--max-size", type=int, default=3000)
+    run_parser.add_argument("--seed", type=int, default=0)
+    compare_parser = commands.add_parser("compare", help="compare two JSON files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "max_size": args.max_size,
+            "results": run(args.max_size, args.seed, log=sys.stdout),
+        }
+        f = open(args.output, "w")
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+        return 0
+    old = json.load(open(args.old))
+    new = json.load(open(args.new))
+    (rows, regressions) = compare(old, new, args.threshold)
+    for ((name, workload, size), before, after, time_ratio, memory_ratio) in rows:
+        flag = ""
+        worse = regressions.get((name, workload, size), [])
+        if "time" in worse:
+            flag += "  SLOWER"
+        if "memory" in worse:
+            flag += "  LARGER"
+        print "%-22s %-13s %8d %10.4fs %10.4fs %6s %8s %8s %6s%s" % (
+            name, workload, size, before["seconds"], after["seconds"], format_ratio(time_ratio),
+            format_bytes(before.get("peak_bytes")), format_bytes(after.get("peak_bytes")),
+            format_ratio(memory_ratio), flag)
+    return len(regressions) and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
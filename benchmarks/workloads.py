@@ -0,0 +1,52 @@
+"""Reproducible DFA workloads for the benchmarks. Every generator takes a size
+and a seed, and returns the same automaton for the same arguments.
+"""
+
+import random
+
+import DFA
+
+ALPHABET = 'abcdefghij'
+
+def geometric_sizes(smallest, largest, factor=10**0.5):
+    """Returns sizes from "smallest" up to "largest", growing by about "factor"."""
+    sizes = []
+    size = float(smallest)
+    while int(round(size)) <= largest:
+        sizes.append(int(round(size)))
+        size *= factor
+    return sizes
+
+def random_words(count, seed=0, max_length=12):
+    """Returns "count" distinct random words over ALPHABET, in sorted order."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        length = rng.randint(1, max_length)
+        words.add(''.join([rng.choice(ALPHABET) for i in range(length)]))
+    return sorted(words)
+
+def random_strings(count, length, alphabet, seed=0):
+    """Returns "count" random strings of the given length, as lists of symbols."""
+    rng = random.Random(seed)
+    alphabet = sorted(alphabet)
+    return [[rng.choice(alphabet) for i in range(length)] for j in range(count)]
+
+def random_dfa(size, seed=0, alphabet_size=2):
+    """A DFA.random() automaton with "size" states."""
+    random.seed(seed)
+    return DFA.random(size, alphabet_size)
+
+def modular_dfa(size, seed=0):
+    """A DFA.modular_zero() automaton with "size" states. The seed is unused."""
+    return DFA.modular_zero(size)
+
+def word_list_dfa(size, seed=0):
+    """A DFA.from_word_list() automaton for "size" random words."""
+    return DFA.from_word_list(random_words(size, seed), ALPHABET)
+
+WORKLOADS = {
+    "random": random_dfa,
+    "modular_zero": modular_dfa,
+    "word_list": word_list_dfa,
+}
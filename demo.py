@@ -52,3 +52,17 @@ print "==...then Finite-Difference Minimized==="
 e.hyper_minimize()
 e.pretty_print()
 #raw_input()
+
+#Scanning a memory-mapped file
+import mmap, tempfile
+f = tempfile.TemporaryFile()
+f.write("10100" * 10)
+f.flush()
+buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+print "Offsets at which d accepts while scanning an mmap of '10100'*10:"
+first = list(d.scan(buf, restart=True))
+print first
+assert list(d.scan(buf, restart=True)) == first #repeated scans start over
+assert [offset for (offset, label) in d.matches(buf)] == list(d.scan(buf))
+buf.close()
+f.close()